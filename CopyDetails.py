@@ -2,8 +2,12 @@ class CopyDetails:
 
     src = None  # Source file or directory
     dest = None  # Destination file or directory
+    frozen_src = None  # Point-in-time capture of the source to copy from (None to copy the source directly)
+    frozen_kind = None  # How the capture was made (see operations/snapshots.py)
+    capture_changed = False  # Whether the live source changed while a non-atomic capture was being made
+    exclusions = None  # Paths ignored when checking the source for changes
 
-    init_mod_timestamp = None  # Timestamp of source before any operations occur
+    init_mod_timestamp = None  # Timestamp of source before any operations occur (any timestamp newer than last_mod_timestamp if one exists)
     pre_copy_mod_timestamp = None  # Tiemstamp of source immediately before copy (only if a copy takes place)
     last_mod_timestamp = None  # Timestamp of the previous copy attempt
 
@@ -4,11 +4,12 @@ from .CopyDetails import CopyDetails
 from .constants import ResultCodes as rc
 from .constants import StatusCodes as sc
 from .constants import ExitCodes as ec
-from .operations.local_operations import Operations as default_operations
+from .operations.operations_registry import OperationsRegistry, shared_registry
+from .backup_planner import BackupPlanner
+import inspect
 import sys
 import threading
 import time
-import importlib.util
 
 
 class BackupManager():
@@ -24,12 +25,15 @@ class BackupManager():
         backup_immediately=True,
         operations_module_name=None,
         operations_module_filename=None,
+        operations_settings=None,
+        operations_registry=None,
         allow_skip=False,
         skip_check_exclusions=None,
         permit_copy_failure=False,
         permit_bad_backup_delete_failure=False,
         permit_old_backup_delete_failure=False,
-        logger=None
+        logger=None,
+        log_sink=None
     ):
         self.name = name
         self.src = src
@@ -49,6 +53,11 @@ class BackupManager():
 
         self.status = sc.INACTIVE
         self.exit_code = None
+        self.log_sink = log_sink
+        self.last_copy_duration = None  # seconds taken by the most recent successful copy
+        self.last_copy_destination = None  # where that copy was written
+        self.corrupt_backups = set()  # backups that failed a checksum scrub
+        self.corrupt_backups_lock = threading.Lock()
 
         # Make sure the logger (whether given or created here) has the expected logger types
         self.__required_logger_types = ["info", "warning", "error", "timer", "operation", "interaction", "backup", "MESSAGE"]
@@ -56,7 +65,7 @@ class BackupManager():
         if self.logger is None:
             self.logger = lg.Logger(
                 types=None,
-                printer=lg.Logger.default_print,
+                printer=lg.Logger.default_print if self.log_sink is None else self.log_sink,
                 do_timestamp=True,
                 do_type=True,
                 do_location=True,
@@ -67,22 +76,26 @@ class BackupManager():
             )
         self.logger.add_all_types(self.__required_logger_types)
 
+        if operations_registry is None:
+            operations_registry = shared_registry
         try:
-            spec = importlib.util.spec_from_file_location(operations_module_name, operations_module_filename)
-            operations_module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(operations_module)
-            self.operations = operations_module.Operations
+            self.operations = operations_registry.create_operations(
+                operations_module_name,
+                operations_module_filename,
+                self.logger.operation,
+                operations_settings
+            )
             self.logger.info(f"Loaded operatons package \"{operations_module_name}\" from: {operations_module_filename}")
         except Exception as e:
             self.logger.warning(f"Could not import operations module \"{operations_module_name}\" from: {operations_module_filename}")
             self.logger.warning(f"Caught: {e}")
             self.logger.warning(f"Using default local operations instead")
-            self.operations = default_operations
-        self.operations.set_logger_func(self.logger.operation)
+            self.operations = OperationsRegistry.create_default_operations(self.logger.operation, operations_settings)
+        self.__mod_time_takes_newer_than = BackupManager.__accepts_newer_than(self.operations)
 
 
     @staticmethod
-    def from_settings_dict(settings, logger=None, name=None):
+    def from_settings_dict(settings, logger=None, name=None, log_sink=None):
         return BackupManager(
             src=settings["src"],
             dest_dir=settings["dest_dir"],
@@ -93,12 +106,14 @@ class BackupManager():
             backup_immediately=settings["immediately"],
             operations_module_name=settings["operations_module_name"],
             operations_module_filename=settings["operations_module_filename"],
+            operations_settings=settings.get("operations_settings"),
             allow_skip=settings["allow_skip"],
             skip_check_exclusions=settings["skip_check_exclusions"],
             permit_copy_failure=settings["permit_copy_failure"],
             permit_bad_backup_delete_failure=settings["permit_bad_backup_delete_failure"],
             permit_old_backup_delete_failure=settings["permit_old_backup_delete_failure"],
-            logger=logger
+            logger=logger,
+            log_sink=log_sink
         )
 
 
@@ -122,6 +137,31 @@ class BackupManager():
         return self.name
 
 
+    def flush_log(self, timeout=None):
+        if self.log_sink is None:
+            return True
+        return self.log_sink.flush(timeout)
+
+
+    def get_corrupt_backups(self):
+        with self.corrupt_backups_lock:
+            return sorted(self.corrupt_backups)
+
+
+    def mark_backup_corrupt(self, backup_name, bad_files=None):
+        with self.corrupt_backups_lock:
+            if backup_name in self.corrupt_backups:
+                return
+            self.corrupt_backups.add(backup_name)
+        self.logger.error(f"Backup \"{backup_name}\" failed its checksum scrub (bad files: {bad_files})")
+        self.add_message(f"Backup \"{sut.shorten_string(backup_name, 15, False, True)}\" is corrupt")
+
+
+    def mark_backup_good(self, backup_name):
+        with self.corrupt_backups_lock:
+            self.corrupt_backups.discard(backup_name)
+
+
     def add_message(self, string):
         self.logger.MESSAGE(string)
 
@@ -134,8 +174,28 @@ class BackupManager():
         return self.operations.dest_exists(self.dest_dir)
 
 
-    def get_source_mod_time(self):
-        return self.operations.get_src_mod_time(self.src, self.skip_check_exclusions)
+    @staticmethod
+    def __accepts_newer_than(operations):
+        # Operations modules written before newer_than existed define get_src_mod_time(filename, exclusions=None)
+        try:
+            parameters = inspect.signature(operations.get_src_mod_time).parameters.values()
+        except (TypeError, ValueError):
+            return False
+        return any(p.name == "newer_than" or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
+
+
+    def get_source_mod_time(self, newer_than=None, source=None):
+        filename = self.src if source is None else source
+        if newer_than is None or not self.__mod_time_takes_newer_than:
+            return self.operations.get_src_mod_time(filename, self.skip_check_exclusions)
+        return self.operations.get_src_mod_time(filename, self.skip_check_exclusions, newer_than=newer_than)
+
+
+    def plan(self):
+        # Dry run: reports what a backup would cost without writing to the destination
+        self.logger.info(f"Planning backup of \"{self.src}\" to \"{self.dest_dir}\"")
+        return BackupPlanner().plan(self)
+
 
     def start_timer(self, seconds, callback, args=None, kargs=None):
         timer = threading.Timer(seconds, callback, args, kargs)
@@ -189,9 +249,10 @@ class BackupManager():
 
         copy_details = CopyDetails()
         copy_details.src = self.src
+        copy_details.exclusions = self.skip_check_exclusions
         copy_details.dest = destination
         copy_details.last_mod_timestamp = self.last_timestamp
-        copy_details.init_mod_timestamp = self.get_source_mod_time()
+        copy_details.init_mod_timestamp = self.get_source_mod_time(self.last_timestamp)  # only needs to show whether anything changed
 
         self.operations.setup(copy_details)
 
@@ -201,18 +262,22 @@ class BackupManager():
         copy_duration = None
         end_timestamp = None
         if (not self.allow_skip) or self.operations.check_need(copy_details):
+            # Take a point-in-time capture of the source (if the operations support it) and copy from that
+            self.operations.freeze(copy_details)
+            copy_source = self.src if copy_details.frozen_src is None else copy_details.frozen_src
+
             # Copy the file to a backup
             self.operations.conditional_setup(copy_details)
-            self.logger.backup(f"Copying \"{self.src}\" to \"{destination}\"")
+            self.logger.backup(f"Copying \"{copy_source}\" to \"{destination}\"")
             self.add_message(f"Starting to copy to \"{dest}\"")
             self.status = sc.COPYING
-            start_timestamp = self.get_source_mod_time()
+            start_timestamp = self.get_source_mod_time(source=copy_source)
             self.last_timestamp = start_timestamp
             start_time = time.time()
-            copy_result = self.operations.copy(self.src, destination)
+            copy_result = self.operations.copy(copy_source, destination)
             end_time = time.time()
             copy_duration = round(end_time - start_time, 2)
-            end_timestamp = self.get_source_mod_time()
+            end_timestamp = self.get_source_mod_time(source=copy_source)
             self.logger.backup("Copy complete")
             self.add_message("Copy complete")
             self.status = sc.COPY_COMPLETE
@@ -224,6 +289,7 @@ class BackupManager():
             copy_details.last_mod_timestamp = self.last_timestamp
             copy_details.copy_result = copy_result
             self.operations.conditional_cleanup(copy_details)
+            self.operations.release_freeze(copy_details)
 
         else:
             self.add_message("No changes were detected")
@@ -256,7 +322,8 @@ class BackupManager():
 
         # Check if the source file has changed between the start and end of the copy
         # If it has changed, delete the potentially corrupted backup and reset the timer with a quicker timer
-        if start_timestamp != end_timestamp and (not copy_skipped):
+        # A capture that is not point-in-time can be torn the same way, even though the capture itself never changes
+        if (start_timestamp != end_timestamp or copy_details.capture_changed) and (not copy_skipped):
             self.logger.warning(f"The file \"{self.src}\" changed while being copied")
             self.add_message(f"Copy to \"{dest}\" failed (found changes in source)")
             self.logger.backup(f"Attempting to delete the file \"{destination}\" to avoid possible corruption")
@@ -284,6 +351,8 @@ class BackupManager():
         if not copy_skipped:
             self.logger.backup(f"The file \"{self.src}\" has been copied to \"{destination}\" ({copy_duration} seconds)")
             self.add_message(f"Copy to \"{dest}\" successful ({copy_duration} seconds)")
+            self.last_copy_duration = copy_duration
+            self.last_copy_destination = destination
 
             # Check if an older backup needs to be deleted
             while True:
@@ -291,8 +360,16 @@ class BackupManager():
                 backup_names = self.operations.get_backup_names(self.src, self.dest_dir)
                 if len(backup_names) <= self.max_num_backups:
                     break
-                earliest_backup = self.operations.get_relevant_backup_names(self.src, backup_names, self.dest_dir).first
-                self.logger.backup(f"Deleting \"{earliest_backup}\" as it is the oldest backup")
+                # Corrupt backups go first, and the last good backup is never deleted
+                corrupt_backups = [name for name in backup_names if name in self.get_corrupt_backups()]
+                if len(corrupt_backups) > 0:
+                    earliest_backup = self.operations.get_relevant_backup_names(self.src, corrupt_backups, self.dest_dir).first
+                    self.logger.backup(f"Deleting \"{earliest_backup}\" as it is corrupt")
+                else:
+                    if len(backup_names) <= 1:
+                        break
+                    earliest_backup = self.operations.get_relevant_backup_names(self.src, backup_names, self.dest_dir).first
+                    self.logger.backup(f"Deleting \"{earliest_backup}\" as it is the oldest backup")
                 if not self.operations.delete_dest(earliest_backup):
                     self.logger.error(f"Could not delete \"{earliest_backup}\"")
                     copy_details.result = False
@@ -305,6 +382,7 @@ class BackupManager():
                         return
                     break
                 else:
+                    self.mark_backup_good(earliest_backup)
                     self.logger.info(f"Deleted \"{earliest_backup}\" successfully")
                     self.add_message(f"Deleted \"{sut.shorten_string(earliest_backup, 15, False, True)}\" successfully")
 
@@ -331,6 +409,7 @@ class BackupManager():
     def stop_backup(self):
         self.logger.info(f"Stopping backups for \"{self.name}\"")
         if not self.active:
+            self.flush_log()
             return False
         self.toggle_state(False)  # stop backups
 
@@ -339,6 +418,7 @@ class BackupManager():
             self.timer.join()  # wait for any outstanding timer-related operations
 
         self.logger.info("Backups terminated")
+        self.flush_log()
         return True
 
 
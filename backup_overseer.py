@@ -1,17 +1,21 @@
 from .backup_manager import BackupManager
 from .python_utilities.logger import Logger, LoggerExceptions
+from .log_sink import AsyncLogSink
+from .overseer_shards import ManagerProxy, ShardClient, ShardException, create_copying_flags
+from .backup_scrubber import BackupScrubber
 import threading
 import time
 
 
 class BackupOverseer:
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, log_sink=None):
+        self.log_sink = log_sink
         self.logger = logger
         if logger is None:
             self.logger = Logger(
                 types={},
-                printer=print,
+                printer=print if log_sink is None else log_sink,
                 identifier="OVERSEER",
                 do_timestamp=True,
                 do_type=True,
@@ -26,23 +30,106 @@ class BackupOverseer:
             pass
 
         self.managers = {}  # key: manager name; value: dict { manager, thread }
+        self.shards = []  # worker processes (only used when managers are sharded)
+        self.scrubber = None
 
 
     @staticmethod
     def from_settings_dict(settings, logger=None):
-        overseer = BackupOverseer(logger)
+        if logger is None and settings.get("logger") is not None:
+            logger = Logger.from_settings_dict(settings["logger"], print)
+        log_sink = None
+        if settings.get("log_sink") is not None:
+            # The sink sits in front of whatever printer the logger was configured with
+            printer = print
+            if logger is not None:
+                logger_settings = logger.to_settings_dict()
+                printer = logger_settings["printer_function"]
+            log_sink = AsyncLogSink.from_settings_dict(settings["log_sink"], printer)
+            if logger is not None:
+                logger = Logger.from_settings_dict(logger_settings["logger"], log_sink)
+        overseer = BackupOverseer(logger, log_sink)
+        workers = settings.get("workers", 0)
+        if workers is not None and workers > 0:
+            overseer.add_shards(settings, workers)
+            return overseer
         for details in settings["managers"]:
-            manager_logger = logger
-            if details["logging"] is not None:
-                manager_logger = Logger.from_settings_dict_incl_printer(details["logging"])
-            else:
-                logger_settings = overseer.logger.to_settings_dict()
-                logger_settings["logger"]["identifier"] = details["name"]
-                manager_logger = Logger.from_settings_dict(logger_settings["logger"], logger_settings["printer_function"])
-            overseer.add_manager(BackupManager.from_settings_dict(details["manager"], manager_logger, details["name"]))
+            overseer.add_manager(overseer.create_manager(details))
+        if settings.get("scrubber") is not None:
+            overseer.scrubber = BackupScrubber.from_settings_dict(overseer, settings["scrubber"])
         return overseer
 
 
+    def add_shards(self, settings, workers):
+        # Managers are assigned round-robin unless their details name a specific worker
+        assignments = [[] for _ in range(workers)]
+        for i, details in enumerate(settings["managers"]):
+            worker = details.get("worker")
+            if worker is None:
+                worker = i % workers
+            elif worker < 0 or worker >= workers:
+                raise ValueError(f"Manager \"{details['name']}\" is assigned to worker {worker}, but only workers 0 to {workers - 1} exist")
+            assignments[worker].append(details)
+
+        # Each worker scrubs its own managers, so the configured rate is split between them
+        scrubber_settings = settings.get("scrubber")
+        num_shards = len([managers for managers in assignments if len(managers) > 0])
+        if scrubber_settings is not None and scrubber_settings["bytes_per_second"] is not None and num_shards > 0:
+            scrubber_settings = dict(scrubber_settings, bytes_per_second=scrubber_settings["bytes_per_second"] / num_shards)
+
+        # Workers send their log lines back, so they reach this overseer's printer (and log sink)
+        logger_settings = self.logger.to_settings_dict()
+        copying_flags = create_copying_flags(workers)
+        for index, managers in enumerate(assignments):
+            if len(managers) == 0:
+                continue
+            shard_settings = {
+                "logger": logger_settings["logger"],
+                "scrubber": scrubber_settings,
+                "managers": managers
+            }
+            self.logger.info(f"Starting shard {index} with {len(managers)} manager(s)")
+            shard = ShardClient(index, shard_settings, copying_flags, logger_settings["printer_function"])
+            self.shards.append(shard)
+            for name in shard.manager_names:
+                self.add_manager(ManagerProxy(shard, name))
+
+
+    def close_shards(self):
+        # Workers keep answering calls after stop_all until this is called (or this process exits, since they are daemons)
+        # Afterwards, proxies report the last status, exit code and corrupt backups each worker gave
+        for shard in self.shards:
+            self.logger.info(f"Stopping shard {shard.index}")
+            shard.shutdown()
+        self.shards = []
+
+
+    def create_manager(self, details):
+        if details["logging"] is not None:
+            manager_logger = Logger.from_settings_dict_incl_printer(details["logging"])
+            manager_log_sink = None
+        else:
+            logger_settings = self.logger.to_settings_dict()
+            logger_settings["logger"]["identifier"] = details["name"]
+            printer = logger_settings["printer_function"]
+            manager_logger = Logger.from_settings_dict(logger_settings["logger"], printer)
+            manager_log_sink = self.log_sink if printer is self.log_sink else None
+        return BackupManager.from_settings_dict(details["manager"], manager_logger, details["name"], manager_log_sink)
+
+
+    def flush_log(self, timeout=None):
+        if self.log_sink is None:
+            return True
+        return self.log_sink.flush(timeout)
+
+
+    def close_log(self, timeout=None):
+        # Writes everything still queued; anything logged afterwards goes straight to the printer
+        if self.log_sink is None:
+            return
+        self.log_sink.close(timeout)
+
+
     def get_all_manager_names(self):
         return list(self.managers.keys())
 
@@ -118,13 +205,47 @@ class BackupOverseer:
         return result
 
 
+    def plan_manager(self, manager_name):
+        if not self.manager_exists(manager_name):
+            return None
+        return self.get_manager(manager_name).plan()
+
+
+    def plan_all(self):
+        plans = {}
+        for manager_name in self.managers:
+            self.logger.info(f"Planning manager: {manager_name}")
+            try:
+                plans[manager_name] = self.plan_manager(manager_name)
+            except Exception as e:
+                self.logger.warning(f"Could not plan manager \"{manager_name}\": {e}")
+                plans[manager_name] = None
+        return plans
+
+
+    def start_scrubber(self):
+        if self.scrubber is None:
+            return False
+        self.logger.info("Starting scrubber")
+        return self.scrubber.start()
+
+
+    def stop_scrubber(self):
+        if self.scrubber is None:
+            return False
+        self.logger.info("Stopping scrubber")
+        return self.scrubber.stop()
+
+
     def start_all(self):
         for manager_name in self.managers:
             self.logger.info(f"Starting manager: {manager_name}")
             self.start_manager(manager_name)
+        self.start_scrubber()
 
 
     def stop_all(self, wait_for_threads=True):
+        self.stop_scrubber()
         for manager_name in self.managers:
             self.logger.info(f"Stopping manager: {manager_name}")
             self.stop_manager(manager_name, False)
@@ -133,6 +254,12 @@ class BackupOverseer:
                 self.logger.info(f"Waiting for manager: {manager_name}")
                 self.get_thread(manager_name).join()
                 self.logger.info(f"Manager stopped: {manager_name}")
+        for shard in self.shards:
+            try:
+                shard.stop_all(timeout=None if wait_for_threads else ShardClient.STATUS_TIMEOUT)
+            except ShardException as e:
+                self.logger.warning(f"Could not stop shard {shard.index}: {e}")
+        self.flush_log()
 
 
     def run(self, manager_name, max_time=None):
@@ -161,6 +288,7 @@ class BackupOverseer:
                 timer.join()
 
         self.logger.info(f"Manager \"{manager_name}\" terminated")
+        self.close_log()
 
 
     def run_all(self, max_time=None):
@@ -188,4 +316,5 @@ class BackupOverseer:
             if timer is not None:
                 timer.join()
 
-        self.logger.info("All managers terminated")
\ No newline at end of file
+        self.logger.info("All managers terminated")
+        self.close_log()
\ No newline at end of file
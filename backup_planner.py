@@ -0,0 +1,197 @@
+import hashlib
+import os
+import time
+
+
+class BackupPlanner:
+
+    # Only reads the source (and local destinations); nothing is ever written
+    def __init__(self, sample_bytes=67108864, block_size=1048576, max_hash_bytes=1073741824):
+        self.sample_bytes = sample_bytes
+        self.block_size = block_size
+        self.max_hash_bytes = max_hash_bytes  # the duplicate search stops reading once this much has been read
+
+
+    @staticmethod
+    def __list_source(source):
+        if not os.path.isdir(source):
+            stat = os.stat(source)
+            return [("", source, stat.st_size, stat.st_mtime)]
+        files = []
+        for root, _, filenames in os.walk(source):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path, follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                files.append((os.path.relpath(path, source), path, stat.st_size, stat.st_mtime))
+        return files
+
+
+    def __read_blocks(self, f, counter, max_bytes=None):
+        # Only the reads are timed, so hashing does not count against the source's read speed
+        remaining = max_bytes
+        while remaining is None or remaining > 0:
+            start = time.perf_counter()
+            data = f.read(self.block_size if remaining is None else min(self.block_size, remaining))
+            counter["seconds"] += time.perf_counter() - start
+            if len(data) == 0:
+                return
+            counter["bytes"] += len(data)
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+
+    def __hash_file(self, path, counter, offset=0, max_bytes=None):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for data in self.__read_blocks(f, counter, max_bytes):
+                digest.update(data)
+        return digest.hexdigest()
+
+
+    def __group_by_hash(self, groups, counter, offset=0, max_bytes=None):
+        # Splits each group of (path, size) by the hash of part of each file; only groups of two or more are kept
+        result = []
+        complete = True
+        for group in groups:
+            by_hash = {}
+            for path, size in group:
+                read = size - offset if max_bytes is None else min(size - offset, max_bytes)
+                if counter["bytes"] + read > self.max_hash_bytes:
+                    complete = False
+                    continue
+                try:
+                    digest = self.__hash_file(path, counter, offset, max_bytes)
+                except OSError:
+                    continue
+                by_hash.setdefault(digest, []).append((path, size))
+            result += [matches for matches in by_hash.values() if len(matches) > 1]
+        return result, complete
+
+
+    def __find_duplicates(self, files, counter):
+        # Only files that share a size with another file can be duplicates
+        by_size = {}
+        for rel, path, size, _ in files:
+            if size > 0:
+                by_size.setdefault(size, []).append((path, size))
+        groups = [group for group in by_size.values() if len(group) > 1]
+
+        # The first block rules out most candidates; the rest of a file is only read if its first block matches
+        groups, heads_complete = self.__group_by_hash(groups, counter, max_bytes=self.block_size)
+        matched = [group for group in groups if group[0][1] <= self.block_size]
+        rests, rests_complete = self.__group_by_hash(
+            [group for group in groups if group[0][1] > self.block_size],
+            counter,
+            offset=self.block_size
+        )
+        matched += rests
+
+        duplicate_files = sum(len(group) - 1 for group in matched)
+        duplicate_bytes = sum(group[0][1] * (len(group) - 1) for group in matched)
+        return duplicate_files, duplicate_bytes, heads_complete and rests_complete
+
+
+    def __measure_read_throughput(self, files, counter):
+        # Top up whatever the duplicate search already read with reads from the largest files
+        for _, path, _, _ in sorted(files, key=lambda item: item[2], reverse=True):
+            if counter["bytes"] >= self.sample_bytes:
+                break
+            try:
+                with open(path, "rb") as f:
+                    for _ in self.__read_blocks(f, counter, self.sample_bytes - counter["bytes"]):
+                        pass
+            except OSError:
+                continue
+        if counter["bytes"] == 0 or counter["seconds"] <= 0:
+            return None
+        return counter["bytes"] / counter["seconds"]
+
+
+    @staticmethod
+    def __find_latest_local_backup(manager):
+        try:
+            backup_names = list(manager.operations.get_backup_names(manager.src, manager.dest_dir))
+        except Exception:
+            return None
+        if len(backup_names) == 0:
+            return None
+        # get_relevant_backup_names orders backups by their number, so the newest is the last one left after dropping the oldest
+        while len(backup_names) > 1:
+            backup_names.remove(manager.operations.get_relevant_backup_names(manager.src, backup_names, manager.dest_dir).first)
+        path = manager.operations.get_local_backup_path(backup_names[0])
+        if path is None or not os.path.exists(path):
+            return None
+        return path
+
+
+    @staticmethod
+    def __count_changes(files, latest_backup, last_timestamp):
+        changed_files = 0
+        changed_bytes = 0
+        for rel, _, size, mtime in files:
+            if latest_backup is not None:
+                backup_path = latest_backup if rel == "" else os.path.join(latest_backup, rel)
+                try:
+                    stat = os.stat(backup_path)
+                    if stat.st_size == size and stat.st_mtime == mtime:
+                        continue
+                except OSError:
+                    pass
+            elif mtime <= last_timestamp:
+                continue
+            changed_files += 1
+            changed_bytes += size
+        return changed_files, changed_bytes
+
+
+    def plan(self, manager):
+        files = BackupPlanner.__list_source(manager.src)
+        total_bytes = sum(item[2] for item in files)
+
+        counter = { "bytes": 0, "seconds": 0 }  # reads so far (shared by the duplicate search and the throughput sample)
+        duplicate_files, duplicate_bytes, dedup_complete = self.__find_duplicates(files, counter)
+        read_throughput = self.__measure_read_throughput(files, counter)
+
+        latest_backup = BackupPlanner.__find_latest_local_backup(manager)
+        changed_files, changed_bytes = BackupPlanner.__count_changes(files, latest_backup, manager.last_timestamp)
+
+        free_space = manager.operations.get_dest_free_space(manager.dest_dir)
+        max_use_of_free_space = manager.operations.get_max_use_of_free_space()
+        usable_free_space = None
+        if free_space is not None and max_use_of_free_space is not None:
+            usable_free_space = free_space * max_use_of_free_space
+
+        # A previous real copy is the best measure since it includes the destination's speed
+        throughput = read_throughput
+        throughput_source = "source read sample"
+        if manager.last_copy_duration is not None and manager.last_copy_duration > 0:
+            copied_bytes = manager.operations.get_copied_bytes(manager.last_copy_destination)
+            if copied_bytes is not None and copied_bytes > 0:
+                throughput = copied_bytes / manager.last_copy_duration
+                throughput_source = "previous copy"
+
+        return {
+            "name": manager.get_name(),
+            "src": manager.src,
+            "dest_dir": manager.dest_dir,
+            "files": len(files),
+            "bytes": total_bytes,
+            "compared_against": latest_backup,
+            "changed_files": changed_files,
+            "changed_bytes": changed_bytes,
+            "incremental_savings_bytes": total_bytes - changed_bytes,
+            "duplicate_files": duplicate_files,
+            "dedup_savings_bytes": duplicate_bytes,
+            "dedup_complete": dedup_complete,
+            "free_space": free_space,
+            "usable_free_space": usable_free_space,
+            "fits": None if usable_free_space is None else total_bytes <= usable_free_space,
+            "throughput": throughput,
+            "throughput_source": throughput_source,
+            "projected_seconds": None if throughput is None else round(total_bytes / throughput, 2)
+        }
@@ -0,0 +1,137 @@
+from .constants import StatusCodes as sc
+from .operations.checksums import RateLimiter
+import ctypes
+import os
+import platform
+import threading
+
+
+class BackupScrubber:
+
+    __IOPRIO_WHO_PROCESS = 1
+    __IOPRIO_CLASS_IDLE = 3
+    __IOPRIO_CLASS_SHIFT = 13
+    __SYS_IOPRIO_SET = { "x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314 }
+
+    def __init__(self, overseer, bytes_per_second=10485760, interval=3600, niceness=19, copying_elsewhere=None):
+        self.overseer = overseer
+        self.logger = overseer.logger
+        self.bytes_per_second = bytes_per_second
+        self.interval = interval
+        self.niceness = niceness
+        self.copying_elsewhere = copying_elsewhere  # reports copies made by managers this overseer cannot see
+        self.thread = None
+        self.limiter = None
+
+
+    @staticmethod
+    def from_settings_dict(overseer, settings):
+        return BackupScrubber(
+            overseer,
+            bytes_per_second=settings["bytes_per_second"],
+            interval=settings["interval"],
+            niceness=settings["niceness"]
+        )
+
+
+    def is_active(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+    def any_manager_copying(self):
+        for manager_name in self.overseer.get_all_manager_names():
+            if self.overseer.get_manager(manager_name).get_status() == sc.COPYING:
+                return True
+        return self.copying_elsewhere is not None and self.copying_elsewhere()
+
+
+    def start(self):
+        if self.is_active():
+            return False
+        self.limiter = RateLimiter(self.bytes_per_second, self.any_manager_copying)
+        self.thread = threading.Thread(target=self.__run, name="scrubber", daemon=True)
+        self.thread.start()
+        return True
+
+
+    def stop(self):
+        if not self.is_active():
+            return False
+        self.limiter.stopped.set()
+        self.thread.join()
+        return True
+
+
+    def __lower_priority(self):
+        # Both calls apply to this thread only, so the managers keep their normal priority
+        thread_id = threading.get_native_id()
+        try:
+            os.setpriority(os.PRIO_PROCESS, thread_id, self.niceness)
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"Scrubber could not lower its CPU priority: {e}")
+
+        syscall_number = BackupScrubber.__SYS_IOPRIO_SET.get(platform.machine())
+        if syscall_number is None:
+            self.logger.warning(f"Scrubber cannot set idle I/O priority on \"{platform.machine()}\"")
+            return
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            ioprio = BackupScrubber.__IOPRIO_CLASS_IDLE << BackupScrubber.__IOPRIO_CLASS_SHIFT
+            if libc.syscall(syscall_number, BackupScrubber.__IOPRIO_WHO_PROCESS, thread_id, ioprio) != 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"Scrubber could not set idle I/O priority: {e}")
+
+
+    def scrub_manager(self, manager):
+        # Managers in other processes (sharded overseers) are scrubbed by their own worker
+        if not hasattr(manager, "operations"):
+            return
+        try:
+            backup_names = manager.operations.get_backup_names(manager.src, manager.dest_dir)
+        except Exception as e:
+            self.logger.warning(f"Scrubber could not list backups for \"{manager.get_name()}\": {e}")
+            return
+        for backup_name in backup_names:
+            if self.limiter.stopped.is_set():
+                return
+            self.limiter.consume(0)  # wait for copies to finish before starting the next backup
+            try:
+                bad_files = manager.operations.verify_checksums(backup_name, self.limiter)
+            except Exception as e:
+                self.logger.warning(f"Scrubber could not check \"{backup_name}\": {e}")
+                continue
+            if bad_files is None:
+                if backup_name != manager.last_copy_destination:
+                    self.__record_checksums(manager, backup_name)
+                continue
+            if len(bad_files) > 0 and not manager.operations.dest_exists(backup_name):
+                continue  # deleted by retention while being checked
+            if len(bad_files) > 0:
+                manager.mark_backup_corrupt(backup_name, bad_files)
+            else:
+                manager.mark_backup_good(backup_name)
+
+
+    def __record_checksums(self, manager, backup_name):
+        # Only backfills backups made before checksums were recorded (new copies write their own manifest)
+        if self.limiter.stopped.is_set():
+            return
+        try:
+            manager.operations.record_checksums(backup_name, self.limiter)
+        except Exception as e:
+            self.logger.warning(f"Scrubber could not record checksums for \"{backup_name}\": {e}")
+
+
+    def __run(self):
+        self.__lower_priority()
+        while not self.limiter.stopped.is_set():
+            self.logger.info("Scrubber starting a pass over stored backups")
+            for manager_name in self.overseer.get_all_manager_names():
+                if self.limiter.stopped.is_set():
+                    break
+                if not self.overseer.manager_exists(manager_name):
+                    continue
+                self.scrub_manager(self.overseer.get_manager(manager_name))
+            self.logger.info("Scrubber pass complete")
+            self.limiter.stopped.wait(self.interval)
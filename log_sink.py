@@ -0,0 +1,139 @@
+import queue
+import threading
+
+
+class AsyncLogSink:
+
+    DROP = "drop"  # discard the new message and report how many were lost
+    COALESCE = "coalesce"  # keep only the most recent overflowing message and report how many it replaced
+    BLOCK = "block"  # wait for room in the queue
+
+    def __init__(
+        self,
+        printer=print,
+        max_queue_size=10000,
+        max_batch_size=200,
+        flush_interval=0.5,
+        overflow_policy=COALESCE,
+        name="log-sink"
+    ):
+        if overflow_policy not in (AsyncLogSink.DROP, AsyncLogSink.COALESCE, AsyncLogSink.BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.printer = printer
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.name = name
+
+        self.__queue = queue.Queue(maxsize=max_queue_size)
+        self.__overflow_lock = threading.Lock()
+        self.__overflow_count = 0
+        self.__overflow_last = None
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__writer, name=name, daemon=True)
+        self.__thread.start()
+
+
+    @staticmethod
+    def from_settings_dict(settings, printer=print):
+        return AsyncLogSink(
+            printer=printer,
+            max_queue_size=settings["max_queue_size"],
+            max_batch_size=settings["max_batch_size"],
+            flush_interval=settings["flush_interval"],
+            overflow_policy=settings["overflow_policy"]
+        )
+
+
+    def __call__(self, string):
+        if self.__closed:
+            self.printer(string)
+            return
+        if self.overflow_policy == AsyncLogSink.BLOCK:
+            self.__queue.put(string)
+            return
+        try:
+            self.__queue.put_nowait(string)
+        except queue.Full:
+            with self.__overflow_lock:
+                self.__overflow_count += 1
+                if self.overflow_policy == AsyncLogSink.COALESCE:
+                    self.__overflow_last = string
+
+
+    def get_overflow_count(self):
+        with self.__overflow_lock:
+            return self.__overflow_count
+
+
+    def __take_overflow(self):
+        with self.__overflow_lock:
+            count = self.__overflow_count
+            last = self.__overflow_last
+            self.__overflow_count = 0
+            self.__overflow_last = None
+        if count == 0:
+            return []
+        if last is None:
+            return [f"[{self.name}] {count} log message(s) dropped (queue full)"]
+        return [f"[{self.name}] {count} log message(s) coalesced (queue full); most recent follows", last]
+
+
+    def __write(self, batch):
+        if self.__queue.empty():
+            batch.extend(self.__take_overflow())  # report overflow after the messages queued before it
+        if len(batch) == 0:
+            return
+        try:
+            self.printer("\n".join(batch))
+        except Exception:
+            pass  # a failing printer must never take down the writer thread
+
+
+    def __writer(self):
+        while True:
+            batch = []
+            try:
+                item = self.__queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.__write(batch)
+                continue
+
+            events = []
+            stop = False
+            while True:
+                if isinstance(item, threading.Event):
+                    events.append(item)
+                elif item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.max_batch_size:
+                    break
+                try:
+                    item = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            self.__write(batch)
+            for event in events:
+                event.set()
+            if stop:
+                return
+
+
+    def flush(self, timeout=None):
+        if self.__closed or not self.__thread.is_alive():
+            return True
+        event = threading.Event()
+        self.__queue.put(event)  # always wait for room so the marker is never dropped
+        return event.wait(timeout)
+
+
+    def close(self, timeout=None):
+        if self.__closed:
+            return
+        self.__closed = True
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join(timeout)
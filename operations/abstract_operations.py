@@ -1,75 +1,138 @@
 from abc import ABC, abstractmethod
+from ..python_utilities.files import import_json
+from . import snapshots
+import threading
 
 class AbstractOperations(ABC):
 
-    __log = print
+    settings_filename = None  # JSON settings for the class that defines it (merged over those of its bases)
+
+    __settings_cache = {}  # key: settings filename; value: parsed settings (shared by all instances)
+    __settings_cache_lock = threading.Lock()
+
+    def __init__(self, logger_func=None, settings=None):
+        self._log = print if logger_func is None else logger_func
+        self.__settings_overrides = settings
+        self.__settings = None
+        self.__settings_lock = threading.Lock()
 
     @staticmethod
+    def __load_settings_file(filename):
+        with AbstractOperations.__settings_cache_lock:
+            if filename not in AbstractOperations.__settings_cache:
+                AbstractOperations.__settings_cache[filename] = import_json(filename)
+            return AbstractOperations.__settings_cache[filename]
+
+    def get_settings(self):
+        # Settings are only read the first time they are needed
+        with self.__settings_lock:
+            if self.__settings is None:
+                settings = {}
+                for cls in reversed(type(self).__mro__):
+                    filename = cls.__dict__.get("settings_filename")
+                    if filename is not None:
+                        settings.update(AbstractOperations.__load_settings_file(filename))
+                if self.__settings_overrides is not None:
+                    settings.update(self.__settings_overrides)
+                self.__settings = settings
+            return self.__settings
+
+    def set_logger_func(self, logger_func):
+        self._log = logger_func
+
     @abstractmethod
-    def set_logger_func(logger_func):
+    def setup(self, details):
         pass
 
-    @staticmethod
     @abstractmethod
-    def setup(details):
+    def check_need(self, details):
         pass
 
-    @staticmethod
+    def freeze(self, details):
+        # Runs between check_need and conditional_setup; the copy reads from details.frozen_src when it is set
+        settings = self.get_settings()
+        path = snapshots.get_capture_path(details.src, details.dest, settings.get("staging_path"))
+        method = settings.get("freeze_method", snapshots.NONE)
+        before = None
+        if method not in (snapshots.NONE, snapshots.BTRFS):
+            before = self.get_src_mod_time(details.src, details.exclusions)
+        kind = snapshots.create_capture(details.src, path, method, self._log)
+        if kind is None:
+            return
+        details.frozen_src = path
+        details.frozen_kind = kind
+        if kind not in snapshots.ATOMIC_KINDS and self.get_src_mod_time(details.src, details.exclusions) != before:
+            self._log(f"\"{details.src}\" changed while it was being captured ({kind})")
+            details.capture_changed = True
+
+    def release_freeze(self, details):
+        if details.frozen_src is None:
+            return
+        snapshots.release_capture(details.frozen_src, details.frozen_kind, self._log)
+
     @abstractmethod
-    def check_need(details):
+    def conditional_setup(self, details):
         pass
 
-    @staticmethod
     @abstractmethod
-    def conditional_setup(details):
+    def copy(self, source, destination):
         pass
 
-    @staticmethod
     @abstractmethod
-    def copy(source, destination):
+    def conditional_cleanup(self, details):
         pass
 
-    @staticmethod
     @abstractmethod
-    def conditional_cleanup(details):
+    def cleanup(self, details):
         pass
 
-    @staticmethod
     @abstractmethod
-    def cleanup(details):
+    def final(self, details):
         pass
 
-    @staticmethod
     @abstractmethod
-    def final(details):
+    def src_exists(self, filename):
         pass
 
-    @staticmethod
     @abstractmethod
-    def src_exists(filename):
+    def dest_exists(self, filename):
         pass
 
-    @staticmethod
     @abstractmethod
-    def dest_exists(filename):
+    def delete_dest(self, filename):
         pass
 
-    @staticmethod
     @abstractmethod
-    def delete_dest(filename):
+    def get_src_mod_time(self, filename, exclusions=None, newer_than=None):
         pass
 
-    @staticmethod
     @abstractmethod
-    def get_src_mod_time(filename, exclusions=None):
+    def get_backup_names(self, source, dest_dir):
         pass
 
-    @staticmethod
     @abstractmethod
-    def get_backup_names(source, dest_dir):
+    def get_relevant_backup_names(self, source, backup_names, dest_dir):
         pass
 
-    @staticmethod
-    @abstractmethod
-    def get_relevant_backup_names(source, backup_names, dest_dir):
-        pass
\ No newline at end of file
+    # Backends that can checksum their backups override these (None means unsupported)
+    # Checksums of new backups are recorded by copy(); record_checksums hashes a backup that has none
+    def record_checksums(self, destination, limiter=None):
+        return None
+
+    def verify_checksums(self, destination, limiter=None):
+        return None
+
+    # Used by the dry-run planner (None means unknown)
+    def get_dest_free_space(self, dest_dir):
+        return None
+
+    def get_max_use_of_free_space(self):
+        return None
+
+    def get_local_backup_path(self, backup_name):
+        # Where a backup can be read on this machine (None for remote destinations)
+        return None
+
+    def get_copied_bytes(self, destination):
+        # Bytes moved by the most recent copy to destination
+        return None
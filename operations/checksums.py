@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class RateLimiter:
+
+    # Limits reads to a number of bytes per second and waits while should_pause() is true
+    def __init__(self, bytes_per_second=None, should_pause=None, pause_interval=1):
+        self.bytes_per_second = bytes_per_second
+        self.should_pause = should_pause
+        self.pause_interval = pause_interval
+        self.stopped = threading.Event()
+        self.__start = time.monotonic()
+        self.__consumed = 0
+
+    def consume(self, num_bytes):
+        while self.should_pause is not None and self.should_pause() and not self.stopped.is_set():
+            self.stopped.wait(self.pause_interval)
+            self.__start = time.monotonic()
+            self.__consumed = 0
+        if self.bytes_per_second is None:
+            return
+        self.__consumed += num_bytes
+        ahead = self.__consumed / self.bytes_per_second - (time.monotonic() - self.__start)
+        if ahead > 0:
+            self.stopped.wait(ahead)
+
+
+def get_manifest_filename(target):
+    parent, name = os.path.split(target.rstrip("/"))
+    return os.path.join(parent, f".{name}.sha256.json")
+
+
+def hash_file(path, block_size=1048576, limiter=None):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            if limiter is not None and limiter.stopped.is_set():
+                return None
+            data = f.read(block_size)
+            if len(data) == 0:
+                break
+            digest.update(data)
+            if limiter is not None:
+                limiter.consume(len(data))
+    return digest.hexdigest()
+
+
+def list_files(target):
+    # Symbolic links are copied as links, so only regular files are checksummed
+    if not os.path.isdir(target):
+        return [("", target)]
+    files = []
+    for root, _, filenames in os.walk(target):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if not os.path.islink(path):
+                files.append((os.path.relpath(path, target), path))
+    return files
+
+
+def save_manifest(target, manifest):
+    filename = get_manifest_filename(target)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def write_manifest(target, block_size=1048576, limiter=None):
+    # Hashes a backup as it is now (only used for backups made without a manifest)
+    manifest = {}
+    for rel, path in list_files(target):
+        manifest[rel] = hash_file(path, block_size, limiter)
+        if manifest[rel] is None:
+            return None  # stopped part way through, so there is nothing complete to write
+    save_manifest(target, manifest)
+    return manifest
+
+
+def copy_with_manifest(source, destination, max_use_of_free_space, block_size=1048576, log=print):
+    # The manifest is built from the bytes read for the copy, so anything that goes wrong on the way to disk is caught later
+    try:
+        size = sum(os.lstat(path).st_size for _, path in list_files(source))
+        free_space = shutil.disk_usage(os.path.dirname(os.path.abspath(destination))).free
+    except OSError as e:
+        log(f"Could not copy \"{source}\" to \"{destination}\": {e}")
+        return None
+    if size > free_space * max_use_of_free_space:
+        log(f"Not enough free space to copy \"{source}\" ({size} bytes needed, {free_space} bytes free, {max_use_of_free_space} usable)")
+        return None
+
+    is_dir = os.path.isdir(source)
+    manifest = {}
+
+    def copy_file(src, dst):
+        digest = hashlib.sha256()
+        with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+            while True:
+                data = f_in.read(block_size)
+                if len(data) == 0:
+                    break
+                digest.update(data)
+                f_out.write(data)
+        shutil.copystat(src, dst)
+        manifest[os.path.relpath(src, source) if is_dir else ""] = digest.hexdigest()
+        return dst
+
+    try:
+        if is_dir:
+            shutil.copytree(source, destination, symlinks=True, copy_function=copy_file)
+        else:
+            copy_file(source, destination)
+    except OSError as e:
+        log(f"Could not copy \"{source}\" to \"{destination}\": {e}")
+        try:
+            if os.path.isdir(destination):
+                shutil.rmtree(destination)
+            elif os.path.lexists(destination):
+                os.remove(destination)
+        except OSError:
+            pass
+        return None
+    save_manifest(destination, manifest)
+    return manifest
+
+
+def delete_manifest(target):
+    filename = get_manifest_filename(target)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def verify_manifest(target, block_size=1048576, limiter=None):
+    # Returns the files that are missing or do not match, or None if there is nothing to check against
+    filename = get_manifest_filename(target)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        manifest = json.load(f)
+    bad = []
+    for rel, expected in manifest.items():
+        path = target if rel == "" else os.path.join(target, rel)
+        try:
+            actual = hash_file(path, block_size, limiter)
+        except OSError:
+            bad.append(rel)
+            continue
+        if actual is None:
+            return None  # scrubbing was stopped part way through
+        if actual != expected:
+            bad.append(rel)
+    return bad
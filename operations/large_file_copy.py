@@ -0,0 +1,130 @@
+import os
+import queue
+import shutil
+import threading
+
+
+def _advise(fd, offset, length, advice_name):
+    # posix_fadvise is only a hint, so platforms without it just copy normally
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+def _read_blocks(fd, buffers, filled, errors, drop_source_cache, dontneed_window):
+    offset = 0
+    dropped = 0
+    try:
+        while True:
+            buffer = buffers.get()
+            if buffer is None:
+                return  # the writer gave up
+            num_read = os.readv(fd, [buffer])
+            filled.put((buffer, num_read))
+            if num_read == 0:
+                return
+            offset += num_read
+            if drop_source_cache and offset - dropped >= dontneed_window:
+                _advise(fd, dropped, offset - dropped, "POSIX_FADV_DONTNEED")
+                dropped = offset
+    except Exception as e:
+        errors.append(e)
+        filled.put((None, 0))
+
+
+def copy_large_file(
+    source,
+    destination,
+    max_use_of_free_space,
+    buffer_size,
+    buffer_count,
+    dontneed_window,
+    drop_source_cache=False,
+    log=print,
+    digest=None
+):
+    # digest (a hashlib object) is updated with every byte copied
+    try:
+        size = os.path.getsize(source)
+        free_space = shutil.disk_usage(os.path.dirname(os.path.abspath(destination))).free
+    except OSError as e:
+        log(f"Could not copy \"{source}\" to \"{destination}\": {e}")
+        return False
+    if size > free_space * max_use_of_free_space:
+        log(f"Not enough free space to copy \"{source}\" ({size} bytes needed, {free_space} bytes free, {max_use_of_free_space} usable)")
+        return False
+
+    log(f"Copying large file \"{source}\" ({size} bytes) with {buffer_count} x {buffer_size} byte buffers")
+    errors = []
+    # Memory use is fixed at buffer_count * buffer_size; the reader fills one buffer while the writer drains another
+    buffers = queue.Queue()
+    for _ in range(buffer_count):
+        buffers.put(bytearray(buffer_size))
+    filled = queue.Queue()
+
+    try:
+        src_fd = os.open(source, os.O_RDONLY)
+    except OSError as e:
+        log(f"Could not open \"{source}\": {e}")
+        return False
+    try:
+        dest_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    except OSError as e:
+        os.close(src_fd)
+        log(f"Could not open \"{destination}\": {e}")
+        return False
+
+    reader = threading.Thread(
+        target=_read_blocks,
+        args=(src_fd, buffers, filled, errors, drop_source_cache, dontneed_window),
+        name="large-file-reader",
+        daemon=True
+    )
+    try:
+        _advise(src_fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+        reader.start()
+        offset = 0
+        synced = 0
+        while True:
+            buffer, num_read = filled.get()
+            if buffer is None or num_read == 0:
+                break
+            view = memoryview(buffer)[:num_read]
+            if digest is not None:
+                digest.update(view)
+            while len(view) > 0:
+                view = view[os.write(dest_fd, view):]
+            buffers.put(buffer)
+            offset += num_read
+            # Written pages can only be dropped once they are on disk
+            if offset - synced >= dontneed_window:
+                os.fdatasync(dest_fd)
+                _advise(dest_fd, synced, offset - synced, "POSIX_FADV_DONTNEED")
+                synced = offset
+        os.fdatasync(dest_fd)
+        _advise(dest_fd, synced, 0, "POSIX_FADV_DONTNEED")
+    except OSError as e:
+        errors.append(e)
+    finally:
+        buffers.put(None)
+        reader.join()
+        os.close(src_fd)
+        os.close(dest_fd)
+
+    if len(errors) > 0:
+        log(f"Could not copy \"{source}\" to \"{destination}\": {errors[0]}")
+        try:
+            os.remove(destination)  # do not leave a truncated backup behind
+        except OSError:
+            pass
+        return False
+    try:
+        shutil.copystat(source, destination)
+    except OSError as e:
+        log(f"Could not copy the timestamps and permissions of \"{source}\" to \"{destination}\": {e}")
+        return False
+    return True
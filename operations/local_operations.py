@@ -1,68 +1,115 @@
-from ..python_utilities.logger import Logger
-from ..python_utilities.files import import_json
 from ..python_utilities import files as fut
 from ..python_utilities import file_counting as fc
 from .abstract_operations import AbstractOperations
+from .tree_walker import TreeWalker
+from . import checksums
+from .large_file_copy import copy_large_file
+import hashlib
+import os
+import shutil
 
 class Operations(AbstractOperations):
 
-    __log = Logger.make_generic_logger()
-    __settings = import_json(fut.path_to_directory(__file__) + "/local_operations_settings.json")
-    __max_use_of_free_space = __settings["max_use_of_free_space"]
+    settings_filename = fut.path_to_directory(__file__) + "/local_operations_settings.json"
 
-    @staticmethod
-    def set_logger_func(logger_func):
-        Operations.__log = logger_func
+    def __get_tree_walker(self):
+        # Managers using the same settings file share one pool of scan threads
+        return TreeWalker.get_shared(type(self).settings_filename, self.get_settings()["scan_workers"])
 
-    @staticmethod
-    def setup(details):
-        Operations.__log("Default local setup")
+    def setup(self, details):
+        self._log("Default local setup")
 
-    @staticmethod
-    def check_need(details):
+    def check_need(self, details):
         return details.init_mod_timestamp > details.last_mod_timestamp
 
-    @staticmethod
-    def conditional_setup(details):
-        Operations.__log("Default local conditional_setup")
-
-    @staticmethod
-    def copy(source, destination):
-        return fut.copy(source, destination, Operations.__max_use_of_free_space, Operations.__log)
-
-    @staticmethod
-    def conditional_cleanup(details):
-        Operations.__log("Default local conditional_cleanup")
-
-    @staticmethod
-    def cleanup(details):
-        Operations.__log("Default local cleanup")
-
-    @staticmethod
-    def final(details):
-        Operations.__log("Default local final")
-
-    @staticmethod
-    def src_exists(filename):
+    def conditional_setup(self, details):
+        self._log("Default local conditional_setup")
+
+    def copy(self, source, destination):
+        settings = self.get_settings()
+        record_checksums = settings["record_checksums"]
+        if os.path.isfile(source) and os.path.getsize(source) >= settings["large_file_threshold"]:
+            digest = hashlib.sha256() if record_checksums else None
+            if not copy_large_file(
+                source,
+                destination,
+                settings["max_use_of_free_space"],
+                settings["large_file_buffer_size"],
+                settings["large_file_buffer_count"],
+                settings["large_file_dontneed_window"],
+                settings["large_file_drop_source_cache"],
+                self._log,
+                digest
+            ):
+                return False
+            if digest is not None:
+                checksums.save_manifest(destination, { "": digest.hexdigest() })
+            return True
+        if record_checksums:
+            return checksums.copy_with_manifest(source, destination, settings["max_use_of_free_space"], log=self._log) is not None
+        return fut.copy(source, destination, settings["max_use_of_free_space"], self._log)
+
+    def conditional_cleanup(self, details):
+        self._log("Default local conditional_cleanup")
+
+    def cleanup(self, details):
+        self._log("Default local cleanup")
+
+    def final(self, details):
+        self._log("Default local final")
+
+    def src_exists(self, filename):
         return fut.target_exists(filename)
 
-    @staticmethod
-    def dest_exists(filename):
+    def dest_exists(self, filename):
         return fut.target_exists(filename)
 
-    @staticmethod
-    def delete_dest(filename):
-        return fut.delete(filename, Operations.__log)
+    def delete_dest(self, filename):
+        if not fut.delete(filename, self._log):
+            return False
+        checksums.delete_manifest(filename)
+        return True
 
-    @staticmethod
-    def get_src_mod_time(filename, exclusions=None):
-        return fut.last_modified(filename, exclusions)
+    def get_src_mod_time(self, filename, exclusions=None, newer_than=None):
+        return self.__get_tree_walker().last_modified(filename, exclusions, newer_than)
 
-    @staticmethod
-    def get_backup_names(source, dest_dir):
+    def get_backup_names(self, source, dest_dir):
         items = fut.get_all_items(dest_dir)
         return fc.get_backup_names(source, items)
 
-    @staticmethod
-    def get_relevant_backup_names(source, backup_names, dest_dir):
-        return fc.get_relevant_backup_names(source, backup_names, dest_dir)
\ No newline at end of file
+    def get_relevant_backup_names(self, source, backup_names, dest_dir):
+        return fc.get_relevant_backup_names(source, backup_names, dest_dir)
+
+    def record_checksums(self, destination, limiter=None):
+        if not self.get_settings()["record_checksums"]:
+            return None
+        self._log(f"Recording checksums for existing backup \"{destination}\"")
+        manifest = checksums.write_manifest(destination, limiter=limiter)
+        if manifest is not None and not os.path.exists(destination):
+            checksums.delete_manifest(destination)  # deleted by retention while being hashed
+            return None
+        return manifest
+
+    def verify_checksums(self, destination, limiter=None):
+        return checksums.verify_manifest(destination, limiter=limiter)
+
+    def get_dest_free_space(self, dest_dir):
+        return shutil.disk_usage(dest_dir).free
+
+    def get_max_use_of_free_space(self):
+        return self.get_settings()["max_use_of_free_space"]
+
+    def get_local_backup_path(self, backup_name):
+        return backup_name
+
+    def get_copied_bytes(self, destination):
+        # Local copies always write the whole source, so the backup's size is what was moved
+        if destination is None or not os.path.lexists(destination):
+            return None
+        total = 0
+        for _, path in checksums.list_files(destination):
+            try:
+                total += os.lstat(path).st_size
+            except FileNotFoundError:
+                continue
+        return total
@@ -1,80 +1,81 @@
 from .local_operations import Operations as DefaultOps
-from ..python_utilities.logger import Logger
-from ..python_utilities.files import import_json
-from .constants import ResultCodes as rc
+from ..python_utilities import files as fut
+from ..constants import ResultCodes as rc
 import subprocess
 import sys
 import time
 
 class Operations(DefaultOps):
 
-    __log = Logger.make_generic_logger()
-    __settings = import_json(fut.path_to_directory(__file__) + "/mc_server_operations_settings.json")
-    __screen_name = __settings["screen_name"]
+    settings_filename = fut.path_to_directory(__file__) + "/mc_server_operations_settings.json"
 
-    @staticmethod
-    def __run_screen_command(command):
+    def __run_screen_command(self, command):
         if "linux" not in sys.platform:
-            Operations.__log(f"Cannot execute the following screen command on \"{sys.platform}\": {command}")
+            self._log(f"Cannot execute the following screen command on \"{sys.platform}\": {command}")
             return False
-        subprocess.run(["screen", "-S", Operations.__screen_name, "-X", "stuff", f"{command}\n"])
+        subprocess.run(["screen", "-S", self.get_settings()["screen_name"], "-X", "stuff", f"{command}\n"])
         return True
 
-    @staticmethod
-    def set_logger_func(logger_func):
-        Operations.__log = logger_func
+    def __save_on(self, stage):
+        self._log(f"{stage}: running save-on")
+        self.__run_screen_command("save-on")
+        self._log(f"{stage}: completed save-on")
+        time.sleep(self.get_settings()["save_on_delay"])
 
-    @staticmethod
-    def setup(details):
-        Operations.__log("Starting setup")
-        Operations.__log("setup: running save-off")
-        Operations.__run_screen_command("save-off")
-        Operations.__log("setup: completed save-off")
-        time.sleep(Operations.__settings["save_off_delay"])
-        Operations.__log("setup: running save-all")
-        Operations.__run_screen_command("save-all")
-        Operations.__log("setup: completed save-all")
-        time.sleep(Operations.__settings["save_all_delay"])
-        Operations.__log("Completed setup")
+    def setup(self, details):
+        self._log("Starting setup")
+        self._log("setup: running save-off")
+        self.__run_screen_command("save-off")
+        self._log("setup: completed save-off")
+        time.sleep(self.get_settings()["save_off_delay"])
+        self._log("setup: running save-all")
+        self.__run_screen_command("save-all")
+        self._log("setup: completed save-all")
+        time.sleep(self.get_settings()["save_all_delay"])
+        self._log("Completed setup")
 
-    @staticmethod
-    def conditional_setup(details):
-        Operations.__log("No conditional_setup steps")
+    def freeze(self, details):
+        super().freeze(details)
+        if details.frozen_src is None:
+            self._log("freeze: no capture was made; saving stays off until cleanup")
+            return
+        # The copy reads from the capture, so the server can start saving again straight away
+        self.__save_on("freeze")
 
-    @staticmethod
-    def conditional_cleanup(details):
-        Operations.__log("No conditional_cleanup steps")
+    def conditional_setup(self, details):
+        self._log("No conditional_setup steps")
 
-    @staticmethod
-    def cleanup(details):
-        Operations.__log("Starting cleanup")
-        Operations.__log("cleanup: running save-on")
-        Operations.__run_screen_command("save-on")
-        Operations.__log("cleanup: completed save-on")
-        time.sleep(Operations.__settings["save_on_delay"])
-        Operations.__log("Completed cleanup")
+    def conditional_cleanup(self, details):
+        self._log("No conditional_cleanup steps")
 
-    @staticmethod
-    def final(details):
-        Operations.__log("Starting final")
+    def cleanup(self, details):
+        self._log("Starting cleanup")
+        if details.frozen_src is None:
+            self.__save_on("cleanup")
+        else:
+            self._log("cleanup: save-on already ran after the capture")
+        self._log("Completed cleanup")
+
+    def final(self, details):
+        self._log("Starting final")
         if details.code == rc.SUCCESS:
             if details.skipped:
-                Operations.__run_screen_command("say Backup skipped (no changes found)")
+                self.__run_screen_command("say Backup skipped (no changes found)")
             else:
-                Operations.__run_screen_command("say Backup successful")
+                self.__run_screen_command("say Backup successful")
 
         elif details.code == rc.COPY_ERROR:
-            Operations.__run_screen_command("say There was an error copying the backup (backups have halted)")
+            self.__run_screen_command("say There was an error copying the backup (backups have halted)")
 
         elif details.code == rc.SOURCE_CHANGE:
-            Operations.__run_screen_command("say The source changed while being backed up (retrying)")
+            self.__run_screen_command("say The source changed while being backed up (retrying)")
 
         elif details.code == rc.CANNOT_DELETE_BAD_BACKUP or details.code == rc.CANNOT_DELETE_OLD_BACKUP:
-            Operations.__run_screen_command("say Old/bad backup deletion failed (backups have halted)")
+            self.__run_screen_command("say Old/bad backup deletion failed (backups have halted)")
 
         else:
-            Operations.__run_screen_command("say Unknown result")
-        
+            self.__run_screen_command("say Unknown result")
+
         if details.code != rc.SUCCESS:
-            Operations.__log(str(details))
-        Operations.__log("Completed final")
\ No newline at end of file
+            self._log(str(details))
+        self._log("Completed final")
@@ -0,0 +1,49 @@
+from .local_operations import Operations as default_operations
+from .static_operations import StaticOperationsAdapter, is_static_operations
+import importlib.util
+import os
+import threading
+
+class OperationsRegistry:
+
+    def __init__(self):
+        self.__modules = {}  # key: (module name, absolute filename); value: loaded module
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __get_key(module_name, module_filename):
+        return (module_name, os.path.abspath(module_filename))
+
+    def get_module(self, module_name, module_filename):
+        key = OperationsRegistry.__get_key(module_name, module_filename)
+        with self.__lock:
+            if key not in self.__modules:
+                spec = importlib.util.spec_from_file_location(module_name, module_filename)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                self.__modules[key] = module
+            return self.__modules[key]
+
+    def is_loaded(self, module_name, module_filename):
+        with self.__lock:
+            return OperationsRegistry.__get_key(module_name, module_filename) in self.__modules
+
+    def create_operations(self, module_name, module_filename, logger_func=None, settings=None):
+        operations_class = self.get_module(module_name, module_filename).Operations
+        if is_static_operations(operations_class):
+            return StaticOperationsAdapter(operations_class, logger_func, settings)
+        operations = operations_class(logger_func, settings)
+        if logger_func is not None:
+            operations.set_logger_func(logger_func)  # subclasses with a static set_logger_func keep their logger on the class
+        return operations
+
+    @staticmethod
+    def create_default_operations(logger_func=None, settings=None):
+        return default_operations(logger_func, settings)
+
+    def clear(self):
+        with self.__lock:
+            self.__modules.clear()
+
+
+shared_registry = OperationsRegistry()
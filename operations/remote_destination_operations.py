@@ -1,77 +1,132 @@
-from ..python_utilities.logger import Logger
 from ..python_utilities import remote_files as rfut
 from ..python_utilities import files as fut
 from ..python_utilities import file_counting as fc
-from ..python_utilities.files import import_json
 from .abstract_operations import AbstractOperations
+from .tree_walker import TreeWalker
+from .remote_transfer import SSHTransport, ResumableUploader, TarStreamUploader
+import os
+import threading
 
 class Operations(AbstractOperations):
 
-    __log = Logger.make_generic_logger()
-    __settings = import_json(fut.path_to_directory(__file__) + "/remote_destination_operations_settings.json")
-    __copy_timeout = __settings["copy_timeout"]
-    __get_modification_timestamp_timeout = __settings["get_modification_timestamp_timeout"]
-    __remote_manager = rfut.ProcessSSH(
-        __settings["user"],
-        __settings["host"],
-        __settings["default_timeout"],
-        __log
-    )
-
-    @staticmethod
-    def set_logger_func(logger_func):
-        Operations.__log = logger_func
-        Operations.__remote_manager.set_logger(Operations.__log)
-
-    @staticmethod
-    def setup(details):
-        Operations.__log("Default remote setup")
-
-    @staticmethod
-    def check_need(details):
+    settings_filename = fut.path_to_directory(__file__) + "/remote_destination_operations_settings.json"
+
+    def __init__(self, logger_func=None, settings=None):
+        super().__init__(logger_func, settings)
+        self.__remote_manager = None
+        self.__remote_manager_lock = threading.Lock()
+        self.__uploader = None
+        self.__tar_uploader = None
+
+    def __get_remote_manager(self):
+        # The SSH helper is only created the first time the remote host is needed
+        with self.__remote_manager_lock:
+            if self.__remote_manager is None:
+                settings = self.get_settings()
+                self.__remote_manager = rfut.ProcessSSH(
+                    settings["user"],
+                    settings["host"],
+                    settings["default_timeout"],
+                    self._log
+                )
+            return self.__remote_manager
+
+    def __get_uploader(self):
+        with self.__remote_manager_lock:
+            if self.__uploader is None:
+                settings = self.get_settings()
+                journal_dir = settings["journal_dir"]
+                if journal_dir is None:
+                    journal_dir = os.path.join(os.path.expanduser("~"), ".auto_backup", "journals")
+                self.__uploader = ResumableUploader(
+                    SSHTransport(settings["user"], settings["host"], settings["copy_timeout"]),
+                    journal_dir,
+                    settings["chunk_size"],
+                    self._log
+                )
+            return self.__uploader
+
+    def __get_tar_uploader(self):
+        with self.__remote_manager_lock:
+            if self.__tar_uploader is None:
+                settings = self.get_settings()
+                self.__tar_uploader = TarStreamUploader(
+                    SSHTransport(settings["user"], settings["host"], settings["default_timeout"]),
+                    settings["tar_compression"],
+                    settings["tar_compression_level"],
+                    settings["chunk_size"],
+                    settings["pipeline_queue_depth"],
+                    self._log
+                )
+            return self.__tar_uploader
+
+    def __get_tree_walker(self):
+        return TreeWalker.get_shared(type(self).settings_filename, self.get_settings()["scan_workers"])
+
+    def set_logger_func(self, logger_func):
+        super().set_logger_func(logger_func)
+        with self.__remote_manager_lock:
+            if self.__remote_manager is not None:
+                self.__remote_manager.set_logger(self._log)
+            if self.__uploader is not None:
+                self.__uploader.log = self._log
+            if self.__tar_uploader is not None:
+                self.__tar_uploader.log = self._log
+
+    def setup(self, details):
+        self._log("Default remote setup")
+
+    def check_need(self, details):
         return details.init_mod_timestamp > details.last_mod_timestamp
 
-    @staticmethod
-    def conditional_setup(details):
-        Operations.__log("Default remote conditional_setup")
+    def conditional_setup(self, details):
+        self._log("Default remote conditional_setup")
 
-    @staticmethod
-    def copy(source, destination):
-        return Operations.__remote_manager.copy_to_remote(source, destination, Operations.__copy_timeout)
+    def copy(self, source, destination):
+        transfer_mode = self.get_settings()["transfer_mode"]
+        if transfer_mode == "resumable":
+            return self.__get_uploader().upload(source, destination, self.get_settings()["copy_timeout"])
+        if transfer_mode == "tar_stream":
+            return self.__get_tar_uploader().upload(source, destination, self.get_settings()["copy_timeout"])
+        return self.__get_remote_manager().copy_to_remote(source, destination, self.get_settings()["copy_timeout"])
 
-    @staticmethod
-    def conditional_cleanup(details):
-        Operations.__log("Default remote conditional_cleanup")
+    def conditional_cleanup(self, details):
+        self._log("Default remote conditional_cleanup")
 
-    @staticmethod
-    def cleanup(details):
-        Operations.__log("Default remote cleanup")
+    def cleanup(self, details):
+        self._log("Default remote cleanup")
 
-    @staticmethod
-    def final(details):
-        Operations.__log("Default remote final")
+    def final(self, details):
+        self._log("Default remote final")
 
-    @staticmethod
-    def src_exists(filename):
+    def src_exists(self, filename):
         return fut.target_exists(filename)
 
-    @staticmethod
-    def dest_exists(filename):
-        return Operations.__remote_manager.exists(filename)
+    def dest_exists(self, filename):
+        return self.__get_remote_manager().exists(filename)
 
-    @staticmethod
-    def delete_dest(filename):
-        return Operations.__remote_manager.delete(filename)
+    def delete_dest(self, filename):
+        return self.__get_remote_manager().delete(filename)
 
-    @staticmethod
-    def get_src_mod_time(filename, exclusions=None):
-        return fut.last_modified(filename, exclusions)
+    def get_src_mod_time(self, filename, exclusions=None, newer_than=None):
+        return self.__get_tree_walker().last_modified(filename, exclusions, newer_than)
 
-    @staticmethod
-    def get_backup_names(source, dest_dir):
-        items = Operations.__remote_manager.ls(dest_dir)
+    def get_backup_names(self, source, dest_dir):
+        items = self.__get_remote_manager().ls(dest_dir)
         return fc.get_backup_names(source, items)
 
-    @staticmethod
-    def get_relevant_backup_names(source, backup_names, dest_dir):
-        return fc.get_relevant_backup_names(source, backup_names, dest_dir)
\ No newline at end of file
+    def get_relevant_backup_names(self, source, backup_names, dest_dir):
+        return fc.get_relevant_backup_names(source, backup_names, dest_dir)
+
+    def get_dest_free_space(self, dest_dir):
+        settings = self.get_settings()
+        return SSHTransport(settings["user"], settings["host"], settings["default_timeout"]).free_space(dest_dir)
+
+    def get_copied_bytes(self, destination):
+        # Only the resumable and tar stream modes count what they send
+        with self.__remote_manager_lock:
+            uploaders = [self.__uploader, self.__tar_uploader]
+        for uploader in uploaders:
+            if uploader is not None and uploader.last_upload is not None and uploader.last_upload["destination"] == destination:
+                return uploader.last_upload["bytes"]
+        return None
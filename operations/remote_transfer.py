@@ -0,0 +1,550 @@
+import hashlib
+import json
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+
+
+class TransferException(Exception):
+    pass
+
+
+class SSHTransport:
+
+    def __init__(self, user, host, timeout):
+        self.target = f"{user}@{host}"
+        self.timeout = timeout
+        # Every command reuses one multiplexed connection instead of negotiating a new one (one is run per chunk)
+        self.ssh_options = [
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={os.path.join(tempfile.gettempdir(), 'auto-backup-ssh-%C')}",
+            "-o", "ControlPersist=60"
+        ]
+
+    def get_identifier(self):
+        return f"ssh:{self.target}"
+
+    def get_command(self, command):
+        return ["ssh"] + self.ssh_options + [self.target, command]
+
+    def run(self, command, stdin_data=None, timeout=None):
+        try:
+            result = subprocess.run(
+                self.get_command(command),
+                input=stdin_data,
+                capture_output=True,
+                timeout=self.timeout if timeout is None else timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise TransferException(f"Timed out running remote command: {command}")
+        return result
+
+    def __check(self, command, stdin_data=None, timeout=None):
+        result = self.run(command, stdin_data, timeout)
+        if result.returncode != 0:
+            raise TransferException(f"Remote command failed ({result.returncode}): {command}: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout.decode(errors="replace")
+
+    def size(self, path):
+        result = self.run(f"stat -c %s {shlex.quote(path)}")
+        if result.returncode != 0:
+            return None
+        return int(result.stdout.decode().strip())
+
+    def makedirs(self, path):
+        self.__check(f"mkdir -p {shlex.quote(path)}")
+
+    def write_chunk(self, path, offset, data):
+        # dd only touches the given byte range, so earlier confirmed chunks are left as they are
+        self.__check(
+            f"dd of={shlex.quote(path)} bs=1M seek={offset} oflag=seek_bytes conv=notrunc status=none",
+            data
+        )
+
+    def truncate(self, path, size):
+        self.__check(f"truncate -s {size} {shlex.quote(path)}")
+
+    def rename(self, source, destination):
+        self.__check(f"mv -T {shlex.quote(source)} {shlex.quote(destination)}")
+
+    def symlink(self, target, path):
+        self.__check(f"rm -rf {shlex.quote(path)} && ln -s {shlex.quote(target)} {shlex.quote(path)}")
+
+    def delete(self, path):
+        self.__check(f"rm -rf {shlex.quote(path)}")
+
+    def free_space(self, path):
+        lines = self.__check(f"df -Pk {shlex.quote(path)}").strip().splitlines()
+        return int(lines[-1].split()[3]) * 1024
+
+    def open_unpack(self, directory, compressed):
+        command = f"mkdir -p {shlex.quote(directory)} && tar -x{'z' if compressed else ''}f - -C {shlex.quote(directory)}"
+        return subprocess.Popen(self.get_command(command), bufsize=0, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+class LocalDirectoryTransport:
+
+    # Stands in for a remote host by mapping remote paths below a local directory
+    def __init__(self, root):
+        self.root = root
+
+    def get_identifier(self):
+        return f"local:{os.path.abspath(self.root)}"
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def size(self, path):
+        try:
+            return os.path.getsize(self.local_path(path))
+        except OSError:
+            return None
+
+    def makedirs(self, path):
+        os.makedirs(self.local_path(path), exist_ok=True)
+
+    def write_chunk(self, path, offset, data):
+        local = self.local_path(path)
+        fd = os.open(local, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def truncate(self, path, size):
+        with open(self.local_path(path), "ab") as f:
+            f.truncate(size)
+
+    def rename(self, source, destination):
+        os.rename(self.local_path(source), self.local_path(destination))
+
+    def symlink(self, target, path):
+        self.delete(path)
+        os.symlink(target, self.local_path(path))
+
+    def delete(self, path):
+        local = self.local_path(path)
+        if os.path.isdir(local) and not os.path.islink(local):
+            shutil.rmtree(local)
+        elif os.path.lexists(local):
+            os.remove(local)
+
+    def free_space(self, path):
+        return shutil.disk_usage(self.local_path(path)).free
+
+    def open_unpack(self, directory, compressed):
+        local = self.local_path(directory)
+        os.makedirs(local, exist_ok=True)
+        command = ["tar", f"-x{'z' if compressed else ''}f", "-", "-C", local]
+        return subprocess.Popen(command, bufsize=0, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def get_temp_path(destination):
+    parent, name = os.path.split(destination.rstrip("/"))
+    return f"{parent}/.{name}.partial"
+
+
+class ResumableUploader:
+
+    def __init__(self, transport, journal_dir, chunk_size, log=print):
+        self.transport = transport
+        self.journal_dir = journal_dir
+        self.chunk_size = chunk_size
+        self.log = log
+        self.last_upload = None  # dict { destination, bytes } for the most recent completed upload
+
+    def __get_journal_filename(self, source, destination):
+        # Managers uploading the same source to other destinations or hosts keep separate journals
+        key = "\n".join([os.path.abspath(source), self.transport.get_identifier(), destination])
+        return os.path.join(self.journal_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.json")
+
+    @staticmethod
+    def __read_journal(filename):
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    def __discard_abandoned_journals(self, source, destination):
+        # A retry that was given a new backup name leaves the old partial upload behind in the same directory
+        if not os.path.isdir(self.journal_dir):
+            return
+        for filename in os.listdir(self.journal_dir):
+            if not filename.endswith(".json"):
+                continue
+            filename = os.path.join(self.journal_dir, filename)
+            try:
+                journal = ResumableUploader.__read_journal(filename)
+            except (OSError, ValueError):
+                continue
+            if journal.get("source") != os.path.abspath(source) or journal.get("transport") != self.transport.get_identifier():
+                continue
+            if journal["destination"] == destination or os.path.dirname(journal["destination"]) != os.path.dirname(destination):
+                continue
+            self.log(f"Discarding unfinished upload to \"{journal['destination']}\"")
+            try:
+                self.transport.delete(journal["temp"])
+                os.remove(filename)
+            except (TransferException, OSError) as e:
+                self.log(f"Could not delete \"{journal['temp']}\": {e}")
+
+    def __load_journal(self, source, destination):
+        self.__discard_abandoned_journals(source, destination)
+        filename = self.__get_journal_filename(source, destination)
+        if os.path.exists(filename):
+            try:
+                return ResumableUploader.__read_journal(filename)
+            except (OSError, ValueError) as e:
+                self.log(f"Ignoring unreadable upload journal \"{filename}\": {e}")
+        return {
+            "source": os.path.abspath(source),
+            "transport": self.transport.get_identifier(),
+            "destination": destination,
+            "temp": get_temp_path(destination),
+            "dirs": [],  # directories created below the temporary path (relative to source)
+            "links": {},  # key: path relative to source; value: link target (links are recreated, not followed)
+            "files": {}  # key: path relative to source; value: dict { size, mtime, offset, done }
+        }
+
+    def __save_journal(self, source, destination, journal):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        filename = self.__get_journal_filename(source, destination)
+        with open(filename + ".tmp", "w") as f:
+            json.dump(journal, f)
+        os.replace(filename + ".tmp", filename)
+
+    def __delete_journal(self, source, destination):
+        filename = self.__get_journal_filename(source, destination)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def __remove_stale_entries(self, journal, dirs, files, links, checkpoint):
+        # Files, links and directories uploaded by an earlier attempt that are no longer in the source
+        temp = journal["temp"]
+        current_files = set(rel for rel, _ in files)
+        for rel in sorted(set(journal["files"]) - current_files):
+            self.log(f"Removing \"{rel}\" from the partial upload (no longer in the source)")
+            self.transport.delete(f"{temp}/{rel}")
+            journal["files"].pop(rel)
+            checkpoint()
+        current_links = dict(links)
+        for rel in sorted(journal["links"]):
+            if current_links.get(rel) != journal["links"][rel]:
+                self.transport.delete(f"{temp}/{rel}")
+                journal["links"].pop(rel)
+                checkpoint()
+        current_dirs = set(dirs)
+        for rel in sorted(set(journal.get("dirs", [])) - current_dirs, reverse=True):
+            self.transport.delete(f"{temp}/{rel}")
+        journal["dirs"] = sorted(current_dirs)
+        checkpoint()
+
+    @staticmethod
+    def __list_source(source):
+        # Symbolic links are recorded as links (as tar_stream does), whether they point at files or directories
+        if not os.path.isdir(source):
+            return [], [("", source)], []
+        dirs = []
+        files = []
+        links = []
+        for root, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for dirname in list(dirnames):
+                path = os.path.join(root, dirname)
+                if os.path.islink(path):
+                    links.append((os.path.relpath(path, source), os.readlink(path)))
+                    dirnames.remove(dirname)
+                else:
+                    dirs.append(os.path.relpath(path, source))
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                if os.path.islink(path):
+                    links.append((os.path.relpath(path, source), os.readlink(path)))
+                else:
+                    files.append((os.path.relpath(path, source), path))
+        return dirs, files, links
+
+    def __upload_file(self, path, remote_path, entry, deadline, checkpoint, sent):
+        stat = os.stat(path)
+        if entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime:
+            entry.clear()
+            entry.update({ "size": stat.st_size, "mtime": stat.st_mtime, "offset": 0, "done": False })
+            checkpoint()  # record the file before anything exists remotely so it can always be cleaned up
+        elif entry["done"]:
+            return True
+        elif entry["offset"] > 0:
+            # Only trust data the remote side actually has
+            remote_size = self.transport.size(remote_path)
+            entry["offset"] = 0 if remote_size is None else min(remote_size, entry["offset"])
+
+        # Creates the file and drops anything past the confirmed offset (e.g. from a changed source file)
+        self.transport.truncate(remote_path, entry["offset"])
+
+        with open(path, "rb") as f:
+            f.seek(entry["offset"])
+            while entry["offset"] < entry["size"]:
+                if deadline is not None and time.time() > deadline:
+                    return False
+                data = f.read(self.chunk_size)
+                if len(data) == 0:
+                    break
+                self.transport.write_chunk(remote_path, entry["offset"], data)
+                entry["offset"] += len(data)
+                sent[0] += len(data)
+                checkpoint()
+        entry["done"] = True
+        return True
+
+    def upload(self, source, destination, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        journal = self.__load_journal(source, destination)
+        temp = journal["temp"]
+        resumed = len(journal["files"]) > 0
+        self.log(f"{'Resuming' if resumed else 'Starting'} upload of \"{source}\" to \"{temp}\"")
+
+        def checkpoint():
+            self.__save_journal(source, destination, journal)
+
+        sent = [0]  # bytes written by this attempt (earlier attempts' data is not counted)
+
+        try:
+            journal.setdefault("links", {})  # missing from journals written before links were recorded
+            dirs, files, links = ResumableUploader.__list_source(source)
+            if os.path.isdir(source):
+                self.transport.makedirs(temp)
+                self.__remove_stale_entries(journal, dirs, files, links, checkpoint)
+                for rel in dirs:
+                    self.transport.makedirs(f"{temp}/{rel}")
+                for rel, target in links:
+                    if journal["links"].get(rel) != target:
+                        self.transport.symlink(target, f"{temp}/{rel}")
+                        journal["links"][rel] = target
+            checkpoint()
+
+            for rel, path in files:
+                remote_path = temp if rel == "" else f"{temp}/{rel}"
+                entry = journal["files"].setdefault(rel, {})
+                try:
+                    completed = self.__upload_file(path, remote_path, entry, deadline, checkpoint, sent)
+                except FileNotFoundError:
+                    continue  # removed from the source mid-upload; cleaned up before the rename
+                checkpoint()
+                if not completed:
+                    self.log(f"Upload of \"{source}\" timed out; it will resume from the last checkpoint")
+                    return False
+
+            # Files can disappear from the source while the upload runs
+            if os.path.isdir(source):
+                dirs, files, links = ResumableUploader.__list_source(source)
+                self.__remove_stale_entries(journal, dirs, files, links, checkpoint)
+            self.transport.rename(temp, destination)
+        except (TransferException, OSError) as e:
+            self.log(f"Upload of \"{source}\" interrupted; it will resume from the last checkpoint: {e}")
+            return False
+
+        self.__delete_journal(source, destination)
+        self.last_upload = { "destination": destination, "bytes": sent[0] }
+        self.log(f"Upload of \"{source}\" to \"{destination}\" complete")
+        return True
+
+
+class _QueueWriter:
+
+    # File-like object that hands fixed-size blocks written by tarfile to the next stage
+    def __init__(self, put, block_size):
+        self.put = put
+        self.block_size = block_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.put(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+class TarStreamUploader:
+
+    NONE = "none"
+    GZIP = "gzip"
+
+    __END = None  # marks the end of a stage's output
+
+    def __init__(self, transport, compression=GZIP, compression_level=6, block_size=1048576, queue_depth=8, log=print):
+        if compression not in (TarStreamUploader.NONE, TarStreamUploader.GZIP):
+            raise ValueError(f"Unknown compression: {compression}")
+        self.transport = transport
+        self.compression = compression
+        self.compression_level = compression_level
+        self.block_size = block_size
+        self.queue_depth = queue_depth
+        self.log = log
+        self.last_upload = None  # dict { destination, bytes } for the most recent completed upload
+
+    @staticmethod
+    def __put(q, item, abort):
+        while not abort.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @staticmethod
+    def __get(q, abort):
+        while not abort.is_set():
+            try:
+                return True, q.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return False, None
+
+    def __archive(self, source, arcname, output, abort, errors, archived):
+        def put(block):
+            self.__put_or_abort(output, block, abort)
+            archived[0] += len(block)
+
+        try:
+            writer = _QueueWriter(put, self.block_size)
+            with tarfile.open(fileobj=writer, mode="w|", bufsize=self.block_size) as tar:
+                tar.add(source, arcname=arcname)
+            writer.flush()
+        except Exception as e:
+            errors.append(f"archive: {e}")
+            abort.set()
+            return
+        TarStreamUploader.__put(output, TarStreamUploader.__END, abort)
+
+    def __put_or_abort(self, q, item, abort):
+        if not TarStreamUploader.__put(q, item, abort):
+            raise TransferException("Transfer aborted")
+
+    def __compress(self, input, output, abort, errors):
+        try:
+            compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip stream
+            while True:
+                ok, block = TarStreamUploader.__get(input, abort)
+                if not ok:
+                    return
+                if block is TarStreamUploader.__END:
+                    break
+                compressed = compressor.compress(block)
+                if len(compressed) > 0:
+                    self.__put_or_abort(output, compressed, abort)
+            self.__put_or_abort(output, compressor.flush(), abort)
+        except Exception as e:
+            errors.append(f"compress: {e}")
+            abort.set()
+            return
+        TarStreamUploader.__put(output, TarStreamUploader.__END, abort)
+
+    def __send(self, input, process, deadline, abort, errors):
+        try:
+            while True:
+                if deadline is not None and time.time() > deadline:
+                    errors.append("send: timed out")
+                    abort.set()
+                    return
+                ok, block = TarStreamUploader.__get(input, abort)
+                if not ok:
+                    return
+                if block is TarStreamUploader.__END:
+                    break
+                view = memoryview(block)
+                while len(view) > 0:
+                    view = view[process.stdin.write(view):]
+            process.stdin.close()  # end of archive
+        except Exception as e:
+            if not abort.is_set():
+                errors.append(f"send: {e}")
+                abort.set()
+
+    @staticmethod
+    def __read_errors(process, output):
+        output.append(process.stderr.read())
+
+    def upload(self, source, destination, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        compressed = self.compression == TarStreamUploader.GZIP
+        temp = get_temp_path(destination)
+        is_dir = os.path.isdir(source)
+        arcname = "." if is_dir else os.path.basename(source)
+        self.log(f"Streaming \"{source}\" to \"{temp}\" ({self.compression} compression)")
+
+        abort = threading.Event()
+        errors = []
+        archived = [0]  # uncompressed archive bytes, so throughput is comparable with the source's size
+        raw_blocks = queue.Queue(maxsize=self.queue_depth)
+        threads = [threading.Thread(target=self.__archive, args=(source, arcname, raw_blocks, abort, errors, archived), name="tar-archive", daemon=True)]
+        send_blocks = raw_blocks
+        if compressed:
+            send_blocks = queue.Queue(maxsize=self.queue_depth)
+            threads.append(threading.Thread(target=self.__compress, args=(raw_blocks, send_blocks, abort, errors), name="tar-compress", daemon=True))
+
+        try:
+            self.transport.delete(temp)
+            process = self.transport.open_unpack(temp, compressed)
+        except (TransferException, OSError) as e:
+            self.log(f"Could not start streaming \"{source}\": {e}")
+            return False
+
+        # Reading, compression and sending overlap; the bounded queues keep memory use fixed
+        # Writes to the channel can block indefinitely if the link stalls, so they run in a thread the deadline can abandon
+        stderr = []
+        sender = threading.Thread(target=self.__send, args=(send_blocks, process, deadline, abort, errors), name="tar-send", daemon=True)
+        error_reader = threading.Thread(target=TarStreamUploader.__read_errors, args=(process, stderr), name="tar-stderr", daemon=True)
+        for thread in threads + [sender, error_reader]:
+            thread.start()
+        while sender.is_alive() and not abort.is_set():
+            if deadline is not None and time.time() > deadline:
+                errors.append("send: timed out")
+                abort.set()
+                break
+            sender.join(0.5)
+        if abort.is_set():
+            process.kill()  # unblocks a sender stuck on a full pipe
+        for thread in threads + [sender]:
+            thread.join()
+
+        try:
+            remaining = None if deadline is None or abort.is_set() else max(deadline - time.time(), 0)
+            process.wait(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            errors.append("unpack: timed out")
+        error_reader.join()
+        if process.returncode != 0:
+            # Listed first since a failed unpack is usually why the other stages broke off (e.g. EPIPE in the sender)
+            detail = b"".join(stderr).decode(errors="replace").strip()
+            errors.insert(0, f"unpack: exited with {process.returncode}" + ("" if len(detail) == 0 else f": {detail}"))
+
+        try:
+            if len(errors) > 0:
+                self.log(f"Streaming \"{source}\" failed: {'; '.join(errors)}")
+                self.transport.delete(temp)
+                return False
+            if is_dir:
+                self.transport.rename(temp, destination)
+            else:
+                self.transport.rename(f"{temp}/{arcname}", destination)
+                self.transport.delete(temp)
+        except (TransferException, OSError) as e:
+            self.log(f"Could not move \"{temp}\" into place: {e}")
+            return False
+
+        self.last_upload = { "destination": destination, "bytes": archived[0] }
+        self.log(f"Streaming \"{source}\" to \"{destination}\" complete")
+        return True
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import shutil
+import subprocess
+
+AUTO = "auto"  # btrfs snapshot if the source is a subvolume, otherwise a reflink clone
+BTRFS = "btrfs"
+REFLINK = "reflink"
+COPY = "copy"  # plain copy into the staging path (slow, but still shorter than the full backup)
+NONE = "none"
+
+ATOMIC_KINDS = [BTRFS]  # reflink and plain copies are made file by file, so a live source can change part way through
+
+_BTRFS_SUBVOLUME_INODE = 256  # the root directory of every btrfs subvolume has this inode number
+
+
+def get_capture_path(source, destination, staging_path=None):
+    # staging_path is a directory that may be shared, so each source and destination directory gets its own capture
+    source = os.path.abspath(source).rstrip("/")
+    parent, name = os.path.split(source)
+    key = hashlib.sha1(f"{source}\n{os.path.dirname(destination.rstrip('/'))}".encode()).hexdigest()[:12]
+    return os.path.join(parent if staging_path is None else staging_path, f".{name}.{key}.frozen")
+
+
+def _run(command, log):
+    try:
+        result = subprocess.run(command, capture_output=True)
+    except OSError as e:
+        log(f"Could not run \"{command[0]}\": {e}")
+        return False
+    if result.returncode != 0:
+        log(f"\"{' '.join(command)}\" failed ({result.returncode}): {result.stderr.decode(errors='replace').strip()}")
+        return False
+    return True
+
+
+def _is_btrfs_subvolume(source):
+    return os.path.isdir(source) and os.stat(source).st_ino == _BTRFS_SUBVOLUME_INODE
+
+
+def _capture_btrfs(source, path, log):
+    if not _is_btrfs_subvolume(source):
+        return False
+    return _run(["btrfs", "subvolume", "snapshot", "-r", source, path], log)
+
+
+def _capture_reflink(source, path, log):
+    # --reflink=always fails instead of silently falling back to a full copy
+    return _run(["cp", "-a", "--reflink=always", source, path], log)
+
+
+def _capture_copy(source, path, log):
+    return _run(["cp", "-a", source, path], log)
+
+
+def create_capture(source, path, method, log=print):
+    # Returns the kind of capture that was made (or None if the source must be read directly)
+    if method == NONE:
+        return None
+    release_capture(path, BTRFS if os.path.isdir(path) and _is_btrfs_subvolume(path) else COPY, log)  # left over from an interrupted run
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if method == AUTO:
+        attempts = [(BTRFS, _capture_btrfs), (REFLINK, _capture_reflink)]
+    elif method == BTRFS:
+        attempts = [(BTRFS, _capture_btrfs)]
+    elif method == REFLINK:
+        attempts = [(REFLINK, _capture_reflink)]
+    elif method == COPY:
+        attempts = [(COPY, _capture_copy)]
+    else:
+        log(f"Unknown freeze method: {method}")
+        return None
+
+    for kind, capture in attempts:
+        if capture(source, path, log):
+            log(f"Captured \"{source}\" at \"{path}\" ({kind})")
+            return kind
+        release_capture(path, COPY, log)  # remove anything a failed attempt left behind
+    log(f"Could not capture \"{source}\"; it will be copied directly")
+    return None
+
+
+def release_capture(path, kind, log=print):
+    if not os.path.lexists(path):
+        return True
+    if kind == BTRFS:
+        return _run(["btrfs", "subvolume", "delete", path], log)
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError as e:
+        log(f"Could not remove \"{path}\": {e}")
+        return False
+    return True
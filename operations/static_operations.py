@@ -0,0 +1,72 @@
+from .abstract_operations import AbstractOperations
+
+
+def is_static_operations(operations_class):
+    # Modules written before operations were instances may not subclass AbstractOperations (and cannot be constructed with settings)
+    return not isinstance(operations_class, type) or not issubclass(operations_class, AbstractOperations)
+
+
+class StaticOperationsAdapter(AbstractOperations):
+
+    # Lets a static-style Operations class be used like an instance; hooks it does not define keep their defaults
+    def __init__(self, operations_class, logger_func=None, settings=None):
+        super().__init__(logger_func, settings)
+        self.operations_class = operations_class
+        self.operations_class.set_logger_func(self._log)
+
+    def __has(self, name):
+        return hasattr(self.operations_class, name)
+
+    def set_logger_func(self, logger_func):
+        super().set_logger_func(logger_func)
+        self.operations_class.set_logger_func(logger_func)
+
+    def setup(self, details):
+        return self.operations_class.setup(details)
+
+    def check_need(self, details):
+        return self.operations_class.check_need(details)
+
+    def conditional_setup(self, details):
+        return self.operations_class.conditional_setup(details)
+
+    def copy(self, source, destination):
+        return self.operations_class.copy(source, destination)
+
+    def conditional_cleanup(self, details):
+        return self.operations_class.conditional_cleanup(details)
+
+    def cleanup(self, details):
+        return self.operations_class.cleanup(details)
+
+    def final(self, details):
+        return self.operations_class.final(details)
+
+    def src_exists(self, filename):
+        return self.operations_class.src_exists(filename)
+
+    def dest_exists(self, filename):
+        return self.operations_class.dest_exists(filename)
+
+    def delete_dest(self, filename):
+        return self.operations_class.delete_dest(filename)
+
+    def get_src_mod_time(self, filename, exclusions=None, newer_than=None):
+        # Static modules always return the latest timestamp, which also satisfies newer_than
+        return self.operations_class.get_src_mod_time(filename, exclusions)
+
+    def get_backup_names(self, source, dest_dir):
+        return self.operations_class.get_backup_names(source, dest_dir)
+
+    def get_relevant_backup_names(self, source, backup_names, dest_dir):
+        return self.operations_class.get_relevant_backup_names(source, backup_names, dest_dir)
+
+    def get_dest_free_space(self, dest_dir):
+        if not self.__has("get_dest_free_space"):
+            return None
+        return self.operations_class.get_dest_free_space(dest_dir)
+
+    def get_max_use_of_free_space(self):
+        if not self.__has("get_max_use_of_free_space"):
+            return None
+        return self.operations_class.get_max_use_of_free_space()
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+import threading
+
+
+class TreeWalker:
+
+    __shared = {}  # key: (settings filename, max workers); value: walker used by every operations instance with those settings
+    __shared_lock = threading.Lock()
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    def __get_executor(self):
+        # Worker threads are only created the first time a tree is walked
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tree-walker")
+            return self.__executor
+
+    @staticmethod
+    def get_shared(settings_filename, max_workers=8):
+        key = (settings_filename, max_workers)
+        with TreeWalker.__shared_lock:
+            if key not in TreeWalker.__shared:
+                TreeWalker.__shared[key] = TreeWalker(max_workers)
+            return TreeWalker.__shared[key]
+
+    def shutdown(self):
+        with self.__lock:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=False, cancel_futures=True)
+                self.__executor = None
+
+    @staticmethod
+    def __is_excluded(root, path, name, exclusions):
+        if exclusions is None:
+            return False
+        return name in exclusions or path in exclusions or os.path.relpath(path, root) in exclusions
+
+    @staticmethod
+    def __scan_directory(root, directory, exclusions):
+        # DirEntry caches its stat result, so each entry costs at most one stat call
+        latest = float("-inf")
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if TreeWalker.__is_excluded(root, entry.path, entry.name, exclusions):
+                        continue
+                    try:
+                        latest = max(latest, entry.stat(follow_symlinks=False).st_mtime)
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                    except (FileNotFoundError, PermissionError):
+                        pass  # removed while being scanned, or unreadable (skipped like unreadable directories)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            pass
+        return latest, subdirectories
+
+    def last_modified(self, path, exclusions=None, newer_than=None):
+        # With newer_than, the walk stops at the first timestamp after it (which is returned instead of the latest)
+        latest = os.stat(path).st_mtime
+        if not os.path.isdir(path) or (newer_than is not None and latest > newer_than):
+            return latest
+
+        executor = self.__get_executor()
+        pending = { executor.submit(TreeWalker.__scan_directory, path, path, exclusions) }
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory_latest, subdirectories = future.result()
+                latest = max(latest, directory_latest)
+                for subdirectory in subdirectories:
+                    pending.add(executor.submit(TreeWalker.__scan_directory, path, subdirectory, exclusions))
+            if newer_than is not None and latest > newer_than:
+                for future in pending:
+                    future.cancel()
+                break
+        return latest
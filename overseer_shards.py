@@ -0,0 +1,270 @@
+from .constants import StatusCodes as sc
+import multiprocessing
+import signal
+import threading
+
+
+COPYING_POLL_INTERVAL = 0.5  # seconds between updates of a worker's copying flag
+
+
+class ShardException(Exception):
+    pass
+
+
+class ManagerProxy:
+
+    # Calls made through the proxy look the same as calls made on a local BackupManager
+    def __init__(self, shard, name):
+        self.shard = shard
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+    def is_active(self):
+        if not self.shard.is_alive():
+            return False
+        try:
+            return self.shard.call(self.name, "is_active")
+        except ShardException:
+            return self.shard.is_alive()  # a busy worker that did not answer in time is still running
+
+    def __get_state(self, method):
+        # Once the worker has shut down, the state it reported on the way out is returned instead
+        final_states = self.shard.get_final_states()
+        if final_states is not None and self.name in final_states:
+            return final_states[self.name][method]
+        return self.shard.call(self.name, method)
+
+    def get_status(self):
+        return self.__get_state("get_status")
+
+    def get_exit_code(self):
+        return self.__get_state("get_exit_code")
+
+    def add_message(self, string):
+        return self.shard.call(self.name, "add_message", string)
+
+    def flush_log(self, timeout=None):
+        return self.shard.call(self.name, "flush_log", timeout, timeout=None)
+
+    def get_corrupt_backups(self):
+        return self.__get_state("get_corrupt_backups")
+
+    def plan(self):
+        return self.shard.call(self.name, "plan", timeout=None)
+
+    def start_backup(self):
+        return self.shard.call(self.name, "start_backup", timeout=None)
+
+    def stop_backup(self):
+        if not self.shard.is_alive():
+            return False
+        return self.shard.call(self.name, "stop_backup", timeout=None)
+
+
+def create_copying_flags(workers):
+    # One flag per worker, set while any of that worker's managers is copying
+    return multiprocessing.get_context("spawn").RawArray("b", workers)
+
+
+class ShardClient:
+
+    SHUTDOWN = "__shutdown__"
+    STOP_ALL = "__stop_all__"
+    LOG = "__log__"  # sent by the worker with a line for the parent's printer
+    FINAL_STATE_METHODS = ["get_status", "get_exit_code", "get_corrupt_backups"]
+    STATUS_TIMEOUT = 10  # seconds to wait for a quick call (long-running calls pass timeout=None)
+
+    # Manager methods that may be called from the parent process
+    ALLOWED_METHODS = [
+        "is_active",
+        "get_status",
+        "get_exit_code",
+        "get_corrupt_backups",
+        "add_message",
+        "flush_log",
+        "plan",
+        "start_backup",
+        "stop_backup"
+    ]
+
+    def __init__(self, index, overseer_settings, copying_flags, printer=print):
+        self.index = index
+        self.printer = printer
+        self.__final_states = None
+        self.manager_names = [details["name"] for details in overseer_settings["managers"]]
+
+        context = multiprocessing.get_context("spawn")  # avoid forking a process that already runs threads
+        self.__conn, child_conn = context.Pipe()
+        self.__process = context.Process(
+            target=run_shard,
+            args=(child_conn, overseer_settings, copying_flags, index),
+            name=f"overseer-shard-{index}",
+            daemon=True
+        )
+        self.__process.start()
+        child_conn.close()
+
+        self.__send_lock = threading.Lock()
+        self.__pending_lock = threading.Lock()
+        self.__pending = {}  # key: request id; value: dict { event, result }
+        self.__next_id = 0
+        self.__alive = True
+        self.__receiver = threading.Thread(target=self.__receive, name=f"overseer-shard-{index}-receiver", daemon=True)
+        self.__receiver.start()
+
+    def is_alive(self):
+        return self.__alive
+
+    def get_final_states(self):
+        return self.__final_states
+
+    def __receive(self):
+        while True:
+            try:
+                request_id, ok, value = self.__conn.recv()
+            except (EOFError, OSError):
+                break
+            if request_id == ShardClient.LOG:
+                try:
+                    self.printer(value)
+                except Exception:
+                    pass  # a failing printer must not stop replies from being delivered
+                continue
+            with self.__pending_lock:
+                request = self.__pending.pop(request_id, None)
+            if request is not None:
+                request["result"] = (ok, value)
+                request["event"].set()
+
+        # The worker has gone away, so nothing outstanding will ever be answered
+        self.__alive = False
+        with self.__pending_lock:
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+        for request in pending:
+            request["result"] = (False, f"Shard {self.index} terminated")
+            request["event"].set()
+
+    def call(self, manager_name, method, *args, timeout=STATUS_TIMEOUT):
+        if not self.__alive:
+            raise ShardException(f"Shard {self.index} is not running")
+        request = { "event": threading.Event(), "result": None }
+        with self.__pending_lock:
+            request_id = self.__next_id
+            self.__next_id += 1
+            self.__pending[request_id] = request
+        try:
+            with self.__send_lock:
+                self.__conn.send((request_id, manager_name, method, args))
+        except (EOFError, OSError) as e:
+            with self.__pending_lock:
+                self.__pending.pop(request_id, None)
+            raise ShardException(f"Could not reach shard {self.index}: {e}")
+        if not request["event"].wait(timeout):
+            with self.__pending_lock:
+                self.__pending.pop(request_id, None)
+            raise ShardException(f"Shard {self.index} did not answer \"{method}\" for \"{manager_name}\" in time")
+        ok, value = request["result"]
+        if not ok:
+            raise ShardException(value)
+        return value
+
+    def stop_all(self, timeout=None):
+        # Stops the worker's managers and scrubber; the worker keeps answering calls until shutdown
+        return self.call(None, ShardClient.STOP_ALL, timeout=timeout)
+
+    def shutdown(self, timeout=None):
+        if self.__alive:
+            try:
+                self.__final_states = self.call(None, ShardClient.SHUTDOWN, timeout=timeout)
+            except ShardException:
+                pass
+        self.__process.join(timeout)
+        if self.__process.is_alive():
+            self.__process.terminate()
+            self.__process.join()
+        self.__conn.close()
+
+
+def run_shard(conn, overseer_settings, copying_flags, index):
+    from .backup_overseer import BackupOverseer
+    from .python_utilities.logger import Logger
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when managers stop
+
+    send_lock = threading.Lock()
+
+    def respond(request_id, ok, value):
+        with send_lock:
+            try:
+                conn.send((request_id, ok, value))
+            except (EOFError, OSError):
+                pass
+
+    # Lines go back to the parent so they reach its configured printer (and log sink)
+    logger = Logger.from_settings_dict(overseer_settings["logger"], lambda line: respond(ShardClient.LOG, True, line))
+    overseer = BackupOverseer.from_settings_dict(overseer_settings, logger)
+    stopped = threading.Event()
+
+    def publish_copying():
+        # Lets the scrubbers in other workers hold off while this worker's managers copy
+        while not stopped.wait(COPYING_POLL_INTERVAL):
+            copying = False
+            for manager_name in overseer.get_all_manager_names():
+                if overseer.get_manager(manager_name).get_status() == sc.COPYING:
+                    copying = True
+                    break
+            copying_flags[index] = 1 if copying else 0
+
+    threading.Thread(target=publish_copying, name=f"overseer-shard-{index}-copying", daemon=True).start()
+    if overseer.scrubber is not None:
+        overseer.scrubber.copying_elsewhere = lambda: any(copying_flags)
+    overseer.start_scrubber()
+
+    def get_final_states():
+        return {
+            manager_name: {
+                method: getattr(overseer.get_manager(manager_name), method)()
+                for method in ShardClient.FINAL_STATE_METHODS
+            }
+            for manager_name in overseer.get_all_manager_names()
+        }
+
+    def handle(request_id, manager_name, method, args):
+        try:
+            if method == ShardClient.STOP_ALL:
+                value = overseer.stop_all(False)
+            else:
+                value = getattr(overseer.get_manager(manager_name), method)(*args)
+        except Exception as e:
+            respond(request_id, False, f"{type(e).__name__}: {e}")
+            return
+        respond(request_id, True, value)
+
+    while True:
+        try:
+            request_id, manager_name, method, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if method == ShardClient.SHUTDOWN:
+            overseer.stop_all(False)
+            respond(request_id, True, get_final_states())
+            break
+        if method != ShardClient.STOP_ALL and (method not in ShardClient.ALLOWED_METHODS or not overseer.manager_exists(manager_name)):
+            respond(request_id, False, f"Cannot call \"{method}\" on \"{manager_name}\"")
+            continue
+        # Each request gets its own thread so a slow stop_backup does not hold up status calls
+        threading.Thread(
+            target=handle,
+            args=(request_id, manager_name, method, args),
+            name=f"shard-request-{request_id}",
+            daemon=True
+        ).start()
+
+    overseer.stop_all(False)
+    stopped.set()
+    copying_flags[index] = 0
+    overseer.close_log()
+    conn.close()
@@ -0,0 +1,102 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+# remote_transfer only uses the standard library, so it is loaded on its own (the package needs python_utilities)
+_spec = importlib.util.spec_from_file_location(
+    "remote_transfer",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "operations", "remote_transfer.py")
+)
+remote_transfer = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(remote_transfer)
+
+
+class FailingTransport(remote_transfer.LocalDirectoryTransport):
+
+    # Drops the connection after a number of chunks have been written
+    def __init__(self, root, chunks_before_failure):
+        super().__init__(root)
+        self.chunks_left = chunks_before_failure
+
+    def write_chunk(self, path, offset, data):
+        if self.chunks_left == 0:
+            raise remote_transfer.TransferException("connection lost")
+        self.chunks_left -= 1
+        super().write_chunk(path, offset, data)
+
+
+class TestResumableUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "src")
+        self.remote = os.path.join(self.directory, "remote")
+        self.journal_dir = os.path.join(self.directory, "journals")
+        os.makedirs(os.path.join(self.source, "sub"))
+        os.makedirs(self.remote)
+        self.write("a", os.urandom(10000))
+        self.write("sub/b", os.urandom(10000))
+        self.write("sub/c", os.urandom(10000))
+        self.destination = "/backups/src_backup_1"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, rel, data):
+        with open(os.path.join(self.source, rel), "wb") as f:
+            f.write(data)
+
+    def read_remote(self, rel):
+        with open(os.path.join(self.remote, "backups", "src_backup_1", rel), "rb") as f:
+            return f.read()
+
+    def read_source(self, rel):
+        with open(os.path.join(self.source, rel), "rb") as f:
+            return f.read()
+
+    def upload(self, transport):
+        uploader = remote_transfer.ResumableUploader(transport, self.journal_dir, 4096, log=lambda line: None)
+        return uploader.upload(self.source, self.destination)
+
+    def test_interrupted_upload_is_only_renamed_once_complete(self):
+        self.assertFalse(self.upload(FailingTransport(self.remote, 4)))
+        transport = remote_transfer.LocalDirectoryTransport(self.remote)
+        self.assertFalse(os.path.exists(transport.local_path(self.destination)))
+        self.assertTrue(os.path.isdir(transport.local_path(remote_transfer.get_temp_path(self.destination))))
+        self.assertEqual(len(os.listdir(self.journal_dir)), 1)
+
+    def test_resume_completes_the_upload(self):
+        self.assertFalse(self.upload(FailingTransport(self.remote, 4)))
+        self.assertTrue(self.upload(remote_transfer.LocalDirectoryTransport(self.remote)))
+        for rel in ["a", "sub/b", "sub/c"]:
+            self.assertEqual(self.read_remote(rel), self.read_source(rel))
+        self.assertEqual(os.listdir(os.path.join(self.remote, "backups")), ["src_backup_1"])
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_resume_prunes_entries_removed_from_the_source(self):
+        self.assertFalse(self.upload(FailingTransport(self.remote, 4)))
+        os.remove(os.path.join(self.source, "a"))
+        shutil.rmtree(os.path.join(self.source, "sub"))
+        self.write("d", b"new")
+        self.assertTrue(self.upload(remote_transfer.LocalDirectoryTransport(self.remote)))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.remote, "backups", "src_backup_1"))), ["d"])
+
+    def test_changed_file_is_uploaded_again(self):
+        self.assertFalse(self.upload(FailingTransport(self.remote, 1)))
+        self.write("a", b"short")
+        self.assertTrue(self.upload(remote_transfer.LocalDirectoryTransport(self.remote)))
+        self.assertEqual(self.read_remote("a"), b"short")
+
+    def test_symbolic_links_are_recreated(self):
+        os.symlink("a", os.path.join(self.source, "file_link"))
+        os.symlink("sub", os.path.join(self.source, "dir_link"))
+        self.assertTrue(self.upload(remote_transfer.LocalDirectoryTransport(self.remote)))
+        backup = os.path.join(self.remote, "backups", "src_backup_1")
+        self.assertEqual(os.readlink(os.path.join(backup, "file_link")), "a")
+        self.assertEqual(os.readlink(os.path.join(backup, "dir_link")), "sub")
+
+
+if __name__ == "__main__":
+    unittest.main()